@@ -1,90 +1,415 @@
+import email.utils
+import json
+import logging
+import random
+import re
+import time
+from typing import Callable, NamedTuple
+
 import requests
+from requests.adapters import HTTPAdapter
+
+from batching import MicroBatcher
+from endpoints import Endpoint, EndpointPool, EndpointsUnavailable
+import metrics
+from cache import ResponseCache, cache_key
+from lib import STRUCK_THROUGH, TABLE_SEPARATOR, clean_markdown
+
+logger = logging.getLogger(__name__)
+
+_JSON_OBJECT = re.compile(r"\{.*\}", re.DOTALL)
+# Rough size of a token in English text, close enough for budgeting prompts
+_CHARS_PER_TOKEN = 4
+
+_SYSTEM_PROMPT = """
+    You are part of a notification system that messages users about new items for sale on reddit.
+    The user has opted-in to receive notifications about a set of specified "Include Terms" -
+    essentially a list of keywords corresponding to items they are interested in.
+"""
+
+# Shared by single and batched requests, so both reuse the same cached prompt prefix
+_VALID_INSTRUCTIONS = """
+    Determine if the user should be messaged about this post based on the include terms.
+
+    Here's an example:
+    Include Terms: [5080, ssd]
+    Title: [USA-CA] [H] Z690I Strix, 16GB DDR4, 1 TB 990 Evo+, RTX 5080 FE, Nouvolo Aquanaut, N150, Samsung Tablet [W] Paypal, Cash
+    Body: |Item|Condition|Price|\n|:-|:-|:-|\n|Asus Z690I Strix - only includes what is visible in the pictures, specifically missing the SATA add on card|Used|$140 shipped|\n|Samsung 990 Evo Plus 1TB Gen 4 M.2 NVME SSD|Brand new sealed|$60 shipped |\n|Corsair DDR4 2x8GB (16GB) 3000MHz [Amazon link](https://www.amazon.com/dp/B0134EW7G8)|Brand new sealed|$25 shipped |\n|Corsair XG7 waterblock + backplate for Asus 3090TI cards - this block has been modified to fit on the 4090 TUF OG as well. Just had to dremel out a few bits. The modifications are invisible once the block is installed. See: https://imgur.com/a/I9QltNV |Used|$60 shipped|\n|Hanjiang 240mm radiator (17mm thick for SFF builds)|Used|$50 shipped|\n|Nouvolo Aquanaut Extreme w/ DDC pump|Used|$80 shipped|\n|Samsung S7 FE Tablet 128GB SM-T733 - like new condition, this thing has mostly just been sitting around unused|Used|$140 shipped |\n|N150 mini pc w/ 512GB/16GB -  [BAPCS link](https://www.reddit.com/r/buildapcsales/comments/1kvzrof/prebuilt_e3_mini_pc_intel_n150_16gb_ddr4_ram/) - I bought this because it was a steal but didn't end up having a good use for it. Opened it to make sure I was actually getting a PC, but never powered on. Just offering to pass on a deal before I return it.|New open box|$80 cash only|\n|RTX 5080 FE - will not ship, local sales only|Brand new sealed|$1200 cash only |\n\n&amp;nbsp;\n\nLocal is 94587. I'm happy to discount shipping for local sales.\n\n&amp;nbsp;\n\nPlease send a PM and not a chat request.
+
+    Desired Model Response:
+    True
+
+    Second Example:
+    Include Terms: [iphone 14]
+    (Same title, body as first example)
+
+    Desired Model Response:
+    False
+
+    You should not notify the user if the post is for buying the referenced item, as the
+    user is only interested in posts that are selling the "include terms"
+
+    Third Example:
+    Include Terms: [5080]
+    Title: [USA-IN][H] Paypal, Cash [W] 5080 FE
+    Body: Looking for a 5080 FE for local pickup near 47906. Willing to drive up to an hour and a half. Thanks!\n\n  \nBOUGHT from u/TWISM1977
+
+    Desired Model Response:
+    False
+"""
+
+_VERDICT_INSTRUCTIONS = """
+    Determine if the user should be messaged about this post based on the include terms, and if so
+    create a summary alert title for it. The user only cares about relevant info (price, location,
+    local vs shipping price) for the Include Terms.
+
+    You should not notify the user if the post is for buying the referenced item, as the
+    user is only interested in posts that are selling the "include terms"
+
+    Here's an example:
+    Include Terms: [5080, ssd]
+    Title: [USA-CA] [H] Z690I Strix, 16GB DDR4, 1 TB 990 Evo+, RTX 5080 FE, Nouvolo Aquanaut, N150, Samsung Tablet [W] Paypal, Cash
+    Body: |Item|Condition|Price|\n|:-|:-|:-|\n|Asus Z690I Strix - only includes what is visible in the pictures, specifically missing the SATA add on card|Used|$140 shipped|\n|Samsung 990 Evo Plus 1TB Gen 4 M.2 NVME SSD|Brand new sealed|$60 shipped |\n|Corsair DDR4 2x8GB (16GB) 3000MHz [Amazon link](https://www.amazon.com/dp/B0134EW7G8)|Brand new sealed|$25 shipped |\n|Hanjiang 240mm radiator (17mm thick for SFF builds)|Used|$50 shipped|\n|Nouvolo Aquanaut Extreme w/ DDC pump|Used|$80 shipped|\n|Samsung S7 FE Tablet 128GB SM-T733 - like new condition, this thing has mostly just been sitting around unused|Used|$140 shipped |\n|RTX 5080 FE - will not ship, local sales only|Brand new sealed|$1200 cash only |\n\n&amp;nbsp;\n\nLocal is 94587. I'm happy to discount shipping for local sales.
+
+    Desired Model Response:
+    {"valid": true, "title": "RTX 5080 FE (Local Only) - $1200, Samsung 1TB NVME SSD - $60"}
+
+    Second Example:
+    Include Terms: [iphone 14]
+    (Same title, body as first example)
+
+    Desired Model Response:
+    {"valid": false, "title": ""}
+
+    Third Example:
+    Include Terms: [5080]
+    Title: [USA-IN][H] Paypal, Cash [W] 5080 FE
+    Body: Looking for a 5080 FE for local pickup near 47906. Willing to drive up to an hour and a half. Thanks!\n\n  \nBOUGHT from u/TWISM1977
+
+    Desired Model Response:
+    {"valid": false, "title": ""}
+"""
+
+_RETRY_STATUSES = {429, 500, 502, 503, 504}
+_MAX_RETRY_DELAY = 60
+
+class AIError(Exception):
+    """Raised when the AI endpoint could not produce a usable response."""
+
+class AIUnavailableError(AIError):
+    """Raised without sending a request while every AI endpoint is failing."""
+
+class AIResponseError(AIError):
+    """Raised when the AI endpoint answers with an error status."""
+    def __init__(self, status_code: int, text: str):
+        super().__init__(f"AI endpoint returned {status_code}: {text}")
+        self.status_code = status_code
+        self.text = text
 
 def filter_thinking(response: str, thinking_tag = "thinking") -> str:
     return response.split(f"</{thinking_tag}>")[-1]
 
+def slim_body(body: str, include_terms: list[str], token_budget: int) -> str:
+    """Strip markdown noise from a post body and keep the parts relevant to the include terms.
+
+    Table rows that don't mention a term are dropped. Lines mentioning a term come
+    first, then their table header or neighbouring paragraphs, then the remaining
+    prose, until the token budget is used up. Lines keep their original order.
+    Struck through text is dropped first, so sold items don't read as available.
+    """
+    lines = [" ".join(STRUCK_THROUGH.sub("", line).split()) for line in clean_markdown(body) if not TABLE_SEPARATOR.match(line)]
+    lines = [line for line in lines if line.strip("| ")]
+
+    terms = [term.lower() for term in include_terms]
+    hits = [i for i, line in enumerate(lines) if any(term in line.lower() for term in terms)]
+
+    context = []
+    for i in hits:
+        if lines[i].startswith("|"):
+            header = i
+            while header > 0 and lines[header - 1].startswith("|"):
+                header -= 1
+            context.append(header)
+        else:
+            context.extend(j for j in (i - 1, i + 1) if 0 <= j < len(lines))
+
+    # Other table rows are other items for sale, only keep them if no line mentions a term
+    rest = [i for i, line in enumerate(lines) if not (hits and line.startswith("|"))]
+
+    budget = token_budget * _CHARS_PER_TOKEN
+    kept = set()
+    for i in hits + context + rest:
+        if i in kept:
+            continue
+        if len(lines[i]) > budget:
+            if not kept:
+                lines[i] = lines[i][:budget]
+                kept.add(i)
+            break
+        kept.add(i)
+        budget -= len(lines[i]) + 1
+
+    return "\n".join(lines[i] for i in sorted(kept))
+
+def _parse_content(response: requests.Response) -> str:
+    try:
+        content = response.json()['choices'][0]['message']['content']
+    except (ValueError, KeyError, IndexError, TypeError) as exception:
+        raise AIError(f"Malformed AI response: {response.text}") from exception
+    if not isinstance(content, str):
+        raise AIError(f"Malformed AI response: {response.text}")
+    return filter_thinking(content)
+
+def _retry_after(response: requests.Response) -> float | None:
+    """Seconds to wait according to the Retry-After header, if present."""
+    header = response.headers.get("Retry-After")
+    if not header:
+        return None
+
+    try:
+        delay = float(header)
+    except ValueError:
+        try:
+            delay = email.utils.parsedate_to_datetime(header).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(_MAX_RETRY_DELAY, max(0, delay))
+
+class PostVerdict(NamedTuple):
+    """Combined classification and title for a post."""
+    valid: bool
+    title: str
+
+def parse_verdict(response: str) -> PostVerdict | None:
+    """Parse a combined model response, returning None if it is not usable."""
+    # Models like to wrap JSON in code fences or add a sentence around it
+    found = _JSON_OBJECT.search(filter_thinking(response))
+    if not found:
+        return None
+
+    try:
+        verdict = json.loads(found.group(0))
+    except json.JSONDecodeError:
+        return None
+    return _verdict_from(verdict)
+
+def parse_verdicts(response: str, count: int) -> list[PostVerdict | None]:
+    """Parse a batched model response keyed by "1" to `count`, with None for unusable entries."""
+    return [_verdict_from(entry) for entry in _parse_numbered(response, count)]
+
+def _parse_numbered(response: str, count: int) -> list:
+    """The entries of a JSON object keyed by "1" to `count`, with None for missing ones."""
+    found = _JSON_OBJECT.search(filter_thinking(response))
+    try:
+        entries = json.loads(found.group(0)) if found else {}
+    except json.JSONDecodeError:
+        entries = {}
+    if not isinstance(entries, dict):
+        entries = {}
+    return [entries.get(str(number)) for number in range(1, count + 1)]
+
+def _valid_from(entry) -> bool | None:
+    if isinstance(entry, dict):
+        entry = entry.get("valid")
+    if isinstance(entry, str) and entry.strip().lower() in ("true", "false"):
+        entry = entry.strip().lower() == "true"
+    return entry if isinstance(entry, bool) else None
+
+def _verdict_from(verdict) -> PostVerdict | None:
+    if not isinstance(verdict, dict):
+        return None
+
+    valid = verdict.get("valid")
+    if isinstance(valid, str) and valid.strip().lower() in ("true", "false"):
+        valid = valid.strip().lower() == "true"
+    if not isinstance(valid, bool):
+        return None
+
+    title = verdict.get("title")
+    if not isinstance(title, str):
+        title = ""
+    title = title.strip()
+    if valid and not title:
+        return None
+
+    return PostVerdict(valid, title)
+
+class _BatchKind(NamedTuple):
+    """How a single-post request is asked and answered in a batch."""
+    kind: str
+    instructions: str
+    # What the model returns for each post
+    answer: str
+    parse_entry: Callable
+    # Convert between answers and the single-post response kept in the cache
+    parse_response: Callable
+    to_response: Callable
+
+_VALID_BATCH = _BatchKind(
+    "valid", _VALID_INSTRUCTIONS, "true or false",
+    parse_entry=_valid_from,
+    parse_response=lambda response: 'true' in response.lower(),
+    to_response=str,
+)
+_VERDICT_BATCH = _BatchKind(
+    "verdict", _VERDICT_INSTRUCTIONS, 'an object with a boolean "valid" key and a string "title" key',
+    parse_entry=_verdict_from,
+    parse_response=parse_verdict,
+    to_response=lambda verdict: json.dumps(verdict._asdict()),
+)
+
+class _PendingPost(NamedTuple):
+    title: str
+    body: str
+    include_terms: list[str]
+
 class Client:
-    def __init__(self, url: str, api_key: str, model: str):
+    def __init__(self, url: str, api_key: str, model: str, combined: bool = True, cache: ResponseCache | None = None,
+                 connect_timeout: float = 5, read_timeout: float = 60, max_retries: int = 3, backoff: float = 1,
+                 pool_size: int = 10, token_budget: int = 800, batch_size: int = 1, batch_wait: float = 0.05,
+                 fallbacks: list[tuple[str, str, str]] = (), failure_threshold: int = 3, cooldown: float = 30,
+                 hedge_percentile: float | None = None, degrade: str = "retry"):
         self.url = url
         self.api_key = api_key
+        # Responses are cached under the first model, whichever endpoint answered
         self.model = model
+        self.combined = combined
+        # What the app does with posts while every endpoint is failing, see config.DEGRADE_POLICIES
+        self.degrade = degrade
+        self.cache = cache
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.token_budget = token_budget
+        # Requests made while others are in flight are sent together, see `_answer_batch`
+        self._valid_batcher = None
+        self._verdict_batcher = None
+        if batch_size > 1:
+            self._valid_batcher = MicroBatcher(
+                lambda posts: self._answer_batch(_VALID_BATCH, self._check_post_valid, posts), batch_size, batch_wait)
+            self._verdict_batcher = MicroBatcher(
+                lambda posts: self._answer_batch(_VERDICT_BATCH, self._evaluate_post, posts), batch_size, batch_wait)
+
+        # Tried in order, `fallbacks` are (url, api key, model) used while the ones before them fail
+        self._endpoints = EndpointPool(
+            [Endpoint(endpoint_url, endpoint_key, endpoint_model, failure_threshold, cooldown)
+             for endpoint_url, endpoint_key, endpoint_model in [(url, api_key, model), *fallbacks]],
+            errors=(AIError,),
+            hedge_percentile=hedge_percentile,
+            max_workers=pool_size,
+        )
 
-    def _send_request(self, prompt: str) -> str:
-        """Common method to handle the URL, headers, and processing the response."""
-        url = f'{self.url}/api/chat/completions'
-        headers = {
+        # One keep-alive session so requests reuse pooled connections
+        self._session = requests.Session()
+        self._session.headers.update({
             'Content-Type': 'application/json',
-            'Authorization': f'Bearer {self.api_key}'
-        }
-        data = {
-            "model": self.model,
-            "messages": [
-                {
-                    "role": "user",
-                    "content": f"""
-                        You are part of a notification system that messages users about new items for sale on reddit.
-                        The user has opted-in to receive notifications about a set of specified "Include Terms" -
-                        essentially a list of keywords corresponding to items they are interested in.
-
-                        {prompt}
-                    """
-                }
-            ]
-        }
-        print(f'Sending API Request: ')
-        response = requests.post(url, headers=headers, json=data)
-        print(f"Response from OpenAI API: {response.text}")
-        if response.status_code == 200:
-            return filter_thinking(response.json()['choices'][0]['message']['content'])
-        else:
-            return f"Error: {response.status_code} - {response.text}"
+        })
+        adapter = HTTPAdapter(pool_connections=len(self._endpoints.endpoints), pool_maxsize=pool_size)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
 
-    def check_post_valid(self, title:str, body: str, include_terms: list[str]) -> bool:
-        """Check if the user should be messaged about this post."""
-        # This method is not implemented yet, but we can create a prompt for it
-        prompt = f"""
-            Determine if the user should be messaged about this post based on the include terms.
+    def _cached_request(self, kind: str, instructions: str, prompt: str, title: str, body: str, include_terms: list[str],
+                        usable=lambda response: True) -> str:
+        """Send the prompt unless an identical post was already answered."""
+        if self.cache is None:
+            return self._send_request(instructions, prompt, kind)
 
-            Here's an example:
-            Include Terms: [5080, ssd]
-            Title: [USA-CA] [H] Z690I Strix, 16GB DDR4, 1 TB 990 Evo+, RTX 5080 FE, Nouvolo Aquanaut, N150, Samsung Tablet [W] Paypal, Cash
-            Body: |Item|Condition|Price|\n|:-|:-|:-|\n|Asus Z690I Strix - only includes what is visible in the pictures, specifically missing the SATA add on card|Used|$140 shipped|\n|Samsung 990 Evo Plus 1TB Gen 4 M.2 NVME SSD|Brand new sealed|$60 shipped |\n|Corsair DDR4 2x8GB (16GB) 3000MHz [Amazon link](https://www.amazon.com/dp/B0134EW7G8)|Brand new sealed|$25 shipped |\n|Corsair XG7 waterblock + backplate for Asus 3090TI cards - this block has been modified to fit on the 4090 TUF OG as well. Just had to dremel out a few bits. The modifications are invisible once the block is installed. See: https://imgur.com/a/I9QltNV |Used|$60 shipped|\n|Hanjiang 240mm radiator (17mm thick for SFF builds)|Used|$50 shipped|\n|Nouvolo Aquanaut Extreme w/ DDC pump|Used|$80 shipped|\n|Samsung S7 FE Tablet 128GB SM-T733 - like new condition, this thing has mostly just been sitting around unused|Used|$140 shipped |\n|N150 mini pc w/ 512GB/16GB -  [BAPCS link](https://www.reddit.com/r/buildapcsales/comments/1kvzrof/prebuilt_e3_mini_pc_intel_n150_16gb_ddr4_ram/) - I bought this because it was a steal but didn't end up having a good use for it. Opened it to make sure I was actually getting a PC, but never powered on. Just offering to pass on a deal before I return it.|New open box|$80 cash only|\n|RTX 5080 FE - will not ship, local sales only|Brand new sealed|$1200 cash only |\n\n&amp;nbsp;\n\nLocal is 94587. I'm happy to discount shipping for local sales.\n\n&amp;nbsp;\n\nPlease send a PM and not a chat request.
+        key = cache_key(self.model, kind, title, body, include_terms)
+        response = self.cache.get(key)
+        if response is not None:
+            logger.info("Using cached %s response. %s", kind, self.cache.stats())
+            return response
 
-            Desired Model Response:
-            True
+        response = self._send_request(instructions, prompt, kind)
+        if usable(response):
+            self.cache.put(key, response)
+        return response
 
-            Second Example:
-            Include Terms: [iphone 14]
-            (Same title, body as first example)
+    def _send_request(self, instructions: str, prompt: str, kind: str) -> str:
+        """Common method to handle the URL, headers, and processing the response.
 
-            Desired Model Response:
-            False
+        The static instructions go in the system message, so providers can cache the
+        shared prompt prefix, and only the post itself changes between requests.
+        A failing endpoint falls over to the next one straight away, the last
+        one left retries connection errors, 429 and 5xx responses. Raises
+        AIError once retries run out, and AIUnavailableError while every
+        endpoint is failing.
+        """
+        messages = [
+            {
+                "role": "system",
+                "content": _SYSTEM_PROMPT + instructions
+            },
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ]
+        with metrics.LLM_REQUEST_SECONDS.time(kind=kind):
+            try:
+                return self._endpoints.call(
+                    lambda endpoint, last: self._post_with_retries(endpoint, messages, kind, self.max_retries if last else 0)
+                )
+            except EndpointsUnavailable as exception:
+                raise AIUnavailableError(str(exception)) from exception
 
-            You should not notify the user if the post is for buying the referenced item, as the
-            user is only interested in posts that are selling the "include terms"
+    def _post_with_retries(self, endpoint: Endpoint, messages: list[dict], kind: str, retries: int) -> str:
+        url = f'{endpoint.url}/api/chat/completions'
+        data = {"model": endpoint.model, "messages": messages}
+        headers = {'Authorization': f'Bearer {endpoint.api_key}'}
+        for attempt in range(retries + 1):
+            logger.debug("Sending %s API request to %s, attempt %d", kind, endpoint.name, attempt + 1)
+            try:
+                response = self._session.post(url, json=data, headers=headers, timeout=self.timeout)
+            except requests.RequestException as exception:
+                error = AIError(f"AI request failed: {exception}")
+                delay = None
+            else:
+                logger.debug("Response from OpenAI API: %s", response.text)
+                if response.status_code == 200:
+                    return _parse_content(response)
 
-            Third Example:
-            Include Terms: [5080]
-            Title: [USA-IN][H] Paypal, Cash [W] 5080 FE
-            Body: Looking for a 5080 FE for local pickup near 47906. Willing to drive up to an hour and a half. Thanks!\n\n  \nBOUGHT from u/TWISM1977
+                error = AIResponseError(response.status_code, response.text)
+                if response.status_code not in _RETRY_STATUSES:
+                    metrics.ERRORS.inc(stage="llm")
+                    raise error
+                delay = _retry_after(response)
 
-            Desired Model Response:
-            False
+            metrics.ERRORS.inc(stage="llm")
+            if attempt == retries:
+                raise error
 
-            ---
+            delay = delay if delay is not None else self._backoff_delay(attempt)
+            logger.warning("%s, retrying in %.1f seconds", error, delay)
+            time.sleep(delay)
 
-            Following the example above, return either True or False based on whether the post should be filtered out:
+    def _backoff_delay(self, attempt: int) -> float:
+        """Exponential backoff with full jitter."""
+        return random.uniform(0, min(_MAX_RETRY_DELAY, self.backoff * 2 ** attempt))
+
+    def check_post_valid(self, title:str, body: str, include_terms: list[str]) -> bool:
+        """Check if the user should be messaged about this post.
+
+        With batching on, posts checked from other threads at the same time share one request.
+        """
+        if self._valid_batcher is not None:
+            return self._valid_batcher.submit(_PendingPost(title, body, include_terms))
+        return self._check_post_valid(title, body, include_terms)
+
+    def _check_post_valid(self, title:str, body: str, include_terms: list[str]) -> bool:
+        prompt = f"""
+            Following the examples, return either True or False based on whether the post should be filtered out:
             Include Terms: {include_terms}
             Title: {title}
-            Body: {body}
+            Body: {slim_body(body, include_terms, self.token_budget)}
 
             Your response should contain only True or False, and nothing else.
         """
-        return 'true' in self._send_request(prompt).lower()
+        return 'true' in self._cached_request("valid", _VALID_INSTRUCTIONS, prompt, title, body, include_terms).lower()
 
     def generate_title(self, title: str, body: str, include_terms: list[str]) -> str:
         """Generate a title for the post that only contains relevant info (item, price, etc.)."""
-        prompt = f"""
+        instructions = """
             Create a summary alert title for the given reddit post and "Include Terms". The user only
             cares about relevant info (price, location, local vs shipping price) for the Include Terms:
 
@@ -95,14 +420,127 @@ class Client:
 
             Desired Model Response:
             RTX 5080 FE (Local Only) - $1200, Samsung 1TB NVME SSD - $60
+        """
+        prompt = f"""
+            Following the example, generate a title for the following information:
+            Include Terms: {include_terms}
+            Title: {title}
+            Body: {slim_body(body, include_terms, self.token_budget)}
+
+            Your response should contain only the generated title, and nothing else.
+        """
+        return self._cached_request("title", instructions, prompt, title, body, include_terms)
+
+    def evaluate_post(self, title: str, body: str, include_terms: list[str]) -> PostVerdict | None:
+        """Classify the post and generate its alert title in a single request.
 
-            ---
+        With batching on, posts evaluated from other threads at the same time
+        share one request. Returns None if the response can't be parsed, so
+        callers can fall back to `check_post_valid` and `generate_title`.
+        """
+        if self._verdict_batcher is not None:
+            return self._verdict_batcher.submit(_PendingPost(title, body, include_terms))
+        return self._evaluate_post(title, body, include_terms)
 
-            Following the example above, generate a title for the following information:
+    def _evaluate_post(self, title: str, body: str, include_terms: list[str]) -> PostVerdict | None:
+        prompt = f"""
+            Following the examples, evaluate the following post:
             Include Terms: {include_terms}
             Title: {title}
-            Body: {body}
+            Body: {slim_body(body, include_terms, self.token_budget)}
 
-            Your response should contain only the generated title, and nothing else.
+            Your response should contain only a JSON object with a boolean "valid" key and a string "title" key, and nothing else.
+        """
+        response = self._cached_request(
+            "verdict", _VERDICT_INSTRUCTIONS, prompt, title, body, include_terms,
+            usable=lambda response: parse_verdict(response) is not None,
+        )
+        verdict = parse_verdict(response)
+        if verdict is None:
+            logger.warning("Could not parse combined AI response")
+        return verdict
+
+    def _answer_batch(self, batch: "_BatchKind", single, posts: list["_PendingPost"]) -> list:
+        """Answer several posts in one request, splitting the batch up when the response is malformed.
+
+        `single` answers one post on its own. Answers are cached under the same
+        key as the single-post request, so the two paths share the cache.
+        """
+        if len(posts) == 1:
+            return [single(*posts[0])]
+
+        keys = [cache_key(self.model, batch.kind, *post) for post in posts]
+        cached = [self.cache.get(key) if self.cache is not None else None for key in keys]
+        answers = [batch.parse_response(response) if response is not None else None for response in cached]
+        missing = [index for index, answer in enumerate(answers) if answer is None]
+        if len(missing) <= 1:
+            for index in missing:
+                answers[index] = single(*posts[index])
+            return answers
+
+        numbered = "\n\n".join(
+            f"""Post {number}
+            Include Terms: {posts[index].include_terms}
+            Title: {posts[index].title}
+            Body: {slim_body(posts[index].body, posts[index].include_terms, self.token_budget)}"""
+            for number, index in enumerate(missing, start=1)
+        )
+        prompt = f"""
+            Following the examples, evaluate each of the following numbered posts on its own:
+
+            {numbered}
+
+            Your response should contain only a JSON object mapping each post number to {batch.answer}, and nothing else.
+        """
+        metrics.AI_BATCH_SIZE.observe(len(missing), kind=batch.kind)
+        response = self._send_request(batch.instructions, prompt, f"{batch.kind}_batch")
+        entries = _parse_numbered(response, len(missing))
+
+        failed = []
+        for index, entry in zip(missing, entries):
+            answer = batch.parse_entry(entry)
+            if answer is None:
+                failed.append(index)
+                continue
+            answers[index] = answer
+            if self.cache is not None:
+                self.cache.put(keys[index], batch.to_response(answer))
+
+        if failed:
+            logger.warning("Could not parse %d of %d answers in batched %s response, retrying them",
+                           len(failed), len(missing), batch.kind)
+            # Split a batch the model couldn't answer at all, so one bad post can't keep failing the rest
+            groups = [failed[:len(failed) // 2], failed[len(failed) // 2:]] if len(failed) == len(missing) else [failed]
+            for group in groups:
+                for index, answer in zip(group, self._answer_batch(batch, single, [posts[index] for index in group])):
+                    answers[index] = answer
+        return answers
+
+    def evaluate_post_batch(self, title: str, body: str, term_sets: list[list[str]]) -> list[PostVerdict | None]:
+        """Evaluate one post for several users' include terms in a single request.
+
+        Returns a verdict per term set, in order, with None where the response
+        couldn't be parsed so callers can fall back to `evaluate_post`.
+        """
+        # A stable order keeps the cache key and numbering the same however the users are ordered
+        ordered = sorted(sorted(terms) for terms in term_sets)
+        numbered = "\n".join(f"{number}: {terms}" for number, terms in enumerate(ordered, start=1))
+        every_term = sorted({term for terms in ordered for term in terms})
+        prompt = f"""
+            Following the examples, evaluate the following post once for each numbered list of Include Terms,
+            each list belongs to a different user:
+            {numbered}
+            Title: {title}
+            Body: {slim_body(body, every_term, self.token_budget)}
+
+            Your response should contain only a JSON object mapping each number to an object with a boolean "valid"
+            key and a string "title" key, and nothing else.
         """
-        return self._send_request(prompt)
+        response = self._cached_request(
+            "verdicts", _VERDICT_INSTRUCTIONS, prompt, title, body, ["|".join(terms) for terms in ordered],
+            usable=lambda response: None not in parse_verdicts(response, len(ordered)),
+        )
+        verdicts = dict(zip(map(tuple, ordered), parse_verdicts(response, len(ordered))))
+        if None in verdicts.values():
+            logger.warning("Could not parse every verdict in batched AI response")
+        return [verdicts[tuple(sorted(terms))] for terms in term_sets]
@@ -1,14 +1,151 @@
+import logging
+import queue
+import random
+import threading
+import time
+import weakref
+
 import apprise
 
+import metrics
 from lib import AlertLevel
-from config import AlertConfig
+from config import DEFAULT_WATCHLIST, AlertConfig
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+# Every open client, so a single gauge function can report all of their queues
+_clients = weakref.WeakSet()
+_clients_lock = threading.Lock()
+
+def _queue_depths() -> list[tuple[dict[str, str], int]]:
+    depths = {}
+    with _clients_lock:
+        clients = list(_clients)
+    for client in clients:
+        for dest, destinations in client.destinations.items():
+            for destination in destinations:
+                key = (client.watchlist, destination.service, dest.value)
+                depths[key] = depths.get(key, 0) + destination.pending
+    return [({"watchlist": watchlist, "service": service, "level": level}, depth)
+            for (watchlist, service, level), depth in depths.items()]
+
+metrics.ALERT_QUEUE_DEPTH.set_function(_queue_depths)
+
+def check_config(config: AlertConfig):
+    """Raise RuntimeError for apprise urls of a service that isn't supported, before any client is changed."""
+    for dest in AlertLevel:
+        for conf in config.get(dest):
+            _service(conf)
+
+def _service(conf: str) -> str:
+    service = conf.split(":")[0]
+    if service == "ntfy":
+        raise RuntimeError("ntfy not supported")
+        # self.apprise_client.add(f"{conf}?click={self.config['reddit_url']}")
+    return service
+
+class Destination:
+    """A single pre-built Apprise target with its own delivery thread.
+
+    Each destination retries independently, so a slow or failing service only
+    delays its own messages.
+    """
+    def __init__(self, url: str, service: str, plugin, queue_size: int, retries: int, backoff: float):
+        self.url = url
+        self.service = service
+        self._plugin = plugin
+        self._retries = retries
+        self._backoff = backoff
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._deliver, name=f"alert-{self.service}", daemon=True)
+        self._thread.start()
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def send(self, title: str, body: str):
+        """Queue a message, blocking only if this destination is far behind."""
+        self._queue.put((title, body))
+
+    def close(self):
+        """Deliver queued messages and stop the delivery thread."""
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _deliver(self):
+        while (message := self._queue.get()) is not _STOP:
+            title, body = message
+            for attempt in range(self._retries + 1):
+                try:
+                    with metrics.ALERT_DELIVERY_SECONDS.time(service=self.service):
+                        delivered = self._plugin.notify(title=title, body=body)
+                    if delivered:
+                        break
+                except Exception as exception: # pylint: disable=broad-except
+                    logger.warning("Apprise %s error: %s", self.service, exception)
+
+                metrics.ERRORS.inc(stage="alert")
+                if attempt < self._retries:
+                    time.sleep(random.uniform(0, self._backoff * 2 ** attempt))
+            else:
+                logger.error("Failed to deliver to %s after %d attempts: %s", self.service, self._retries + 1, title)
 
 class Client:
-    def __init__(self, config: AlertConfig):
-        self.apprise_client = apprise.Apprise()
+    def __init__(self, config: AlertConfig, queue_size: int = 100, retries: int = 3, backoff: float = 1, test_destinations: bool = True,
+                 watchlist: str = DEFAULT_WATCHLIST):
+        self.config = config
+        self.watchlist = watchlist
+        self._queue_size = queue_size
+        self._retries = retries
+        self._backoff = backoff
+        self._destinations = {dest: self._build_destinations(dest, {}) for dest in AlertLevel}
+
+        with _clients_lock:
+            _clients.add(self)
+
+        if test_destinations:
+            self._startup()
+
+    @property
+    def destinations(self) -> dict[AlertLevel, list[Destination]]:
+        return self._destinations
+
+    def update(self, config: AlertConfig):
+        """Switch to a changed config, only building the Apprise targets that are new.
+
+        Unchanged targets keep their queued messages, removed ones deliver theirs and stop.
+        Raises RuntimeError, leaving the client as it was, if `check_config` fails.
+        """
+        check_config(config)
+        old = {id(destination): destination for destinations in self._destinations.values() for destination in destinations}
+        current = {destination.url: destination for destination in old.values()}
         self.config = config
+        self._destinations = {dest: self._build_destinations(dest, current) for dest in AlertLevel}
 
-        self._startup()
+        new = {id(destination) for destinations in self._destinations.values() for destination in destinations}
+        removed = [destination for key, destination in old.items() if key not in new]
+        for destination in removed:
+            destination.close()
+        added = len(new - old.keys())
+        if added or removed:
+            logger.info("Alert targets changed: %d added, %d removed", added, len(removed))
+
+    def _build_destinations(self, dest: AlertLevel, current: dict[str, Destination]) -> list[Destination]:
+        destinations = []
+        for conf in self.config.get(dest):
+            if conf in current:
+                destinations.append(current[conf])
+                continue
+            service = _service(conf)
+            plugin = apprise.Apprise.instantiate(conf)
+            if plugin is None:
+                logger.warning("Skipping invalid apprise url for %s at %s level", service, dest.value)
+                continue
+            destinations.append(Destination(conf, service, plugin, self._queue_size, self._retries, self._backoff))
+        return destinations
 
     def _startup(self):
         """Test All Alert Destinations"""
@@ -16,33 +153,28 @@ class Client:
             self._send_message("Test", f"This is a startup message at {dest.value} level", dest)
 
     def _send_message(self, title: str, body: str, dest: AlertLevel):
-        apprise_config = self.config.get(dest)
-        for conf in apprise_config:
-            service = conf.split(":")[0]
-            match service:
-                case "ntfy":
-                    raise RuntimeError("ntfy not supported")
-                    # self.apprise_client.add(f"{conf}?click={self.config['reddit_url']}")
-                case _:
-                    self.apprise_client.add(conf)
-
-        self.apprise_client.notify(
-            title=title,
-            body=body
-        )
-        self.apprise_client.clear()
+        for destination in self._destinations[dest]:
+            destination.send(title, body)
+
+    def close(self):
+        """Wait for queued alerts to be delivered."""
+        with _clients_lock:
+            _clients.discard(self)
+        for destinations in self._destinations.values():
+            for destination in destinations:
+                destination.close()
 
     def notify(self, title, body):
-        print(f"Sending regular notification: {title} <- {body}")
+        logger.info("Sending regular notification: %s", title)
         self._send_message(title, body, AlertLevel.NOTIFY)
 
     def alert_error(self, exception):
-        print("Sending error alert")
+        logger.info("Sending error alert: %s", exception)
         self._send_message(
             title="[ERROR]",
             body=str(exception),
             dest=AlertLevel.ERROR
         )
     def notify_filtered(self, title, body):
-        print(f"Sending filtered notification: {title} <- {body}")
+        logger.info("Sending filtered notification: %s", title)
         self._send_message(title=title, body=body, dest=AlertLevel.FILTER)
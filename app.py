@@ -1,104 +1,399 @@
 """Stream new Reddit posts and notify for matching posts."""
+import argparse
+import logging
+import os
+import signal
 import sys
+import threading
 import time
-
-import praw
-import prawcore
+from typing import NamedTuple
 
 import config
 import ai
+import extract
 from lib import AlertLevel
 import alert
+import metrics
+from pipeline import Pipeline
+from scheduler import PollScheduler
+from seen import SeenStore
+import trade
+from watchlist import Watchlist, WatchlistIndex
+
+logger = logging.getLogger(__name__)
+
+_LOG_FORMAT = "%(asctime)s %(levelname)s [%(threadName)s] %(name)s: %(message)s"
+
+class Notification(NamedTuple):
+    """Alert produced for a matching submission."""
+    title: str
+    post_title: str
+    permalink: str
+    alert_level: AlertLevel
+    watchlist: str = config.DEFAULT_WATCHLIST
+
+class QueuedSubmission(NamedTuple):
+    """The parts of a submission kept in the work queue."""
+    id: str
+    title: str
+    selftext: str
+    permalink: str
 
 def main():
     """Run application."""
-    print("Starting Reddit Post Notifier")
-    reddit_config, ai_config, alert_config = config.load_config()
-    
+    started = time.monotonic()
+    logging.basicConfig(level=os.getenv("RPN_LOG_LEVEL", "INFO").upper(), format=_LOG_FORMAT)
+    logger.info("Starting Reddit Post Notifier")
+    args = _parse_args()
+    reddit_config, ai_config, alert_config, pipeline_config, startup_config, metrics_config, watchlist_configs = \
+        config.load_config(args.skipped_checks)
+
+    if metrics_config.enabled:
+        metrics.serve(metrics_config.host, metrics_config.port)
+
     reddit_client = reddit_config.client
-    subreddits = reddit_config.sub_config
 
     ai_client = ai_config.client
 
-    alert_client = alert.Client(alert_config)
-    
+    # Errors always go to the main alert client, which also serves the default watchlist
+    alert_client = alert.Client(alert_config, test_destinations=startup_config.test_alerts)
+    watchlists = WatchlistIndex([
+        Watchlist(config.DEFAULT_WATCHLIST, reddit_config.sub_config, alert_client),
+        *(Watchlist(watchlist.name, watchlist.sub_config,
+                    alert.Client(watchlist.alert_config, test_destinations=startup_config.test_alerts, watchlist=watchlist.name))
+          for watchlist in watchlist_configs),
+    ])
+
+    # The self test only exercises the AI and alert services, so it doesn't need to hold up the stream
+    if startup_config.self_test:
+        threading.Thread(target=_run_self_test, args=(alert_client, ai_client), name="self-test", daemon=True).start()
+
+    if startup_config.validate_subreddits:
+        invalid_subreddits = reddit_config.validate_subreddits(watchlists.subreddits, startup_config.subreddit_cache_ttl)
+        if invalid_subreddits:
+            sys.exit("Invalid Subreddit: " + ", ".join(invalid_subreddits))
+
+    pipeline = Pipeline(
+        work_queue=pipeline_config.work_queue,
+        evaluate=lambda payload: evaluate_submission(*_from_job(payload), alert_client, ai_client),
+        deliver=lambda notifications: send_notifications(notifications, watchlists),
+        on_error=alert_client.alert_error,
+        on_dead=lambda payload, exception: _give_up(payload, exception, alert_client, watchlists),
+        workers=pipeline_config.workers,
+    )
+    pipeline.start()
+
+    scheduler = PollScheduler(
+        reddit_client,
+        watchlists.subreddits,
+        seen=reddit_config.seen_store,
+        catch_up_limit=reddit_config.catch_up_limit,
+        shard_size=reddit_config.shard_size,
+        min_interval=reddit_config.poll_interval[0],
+        max_interval=reddit_config.poll_interval[1],
+        on_error=alert_client.alert_error,
+    )
+
+    watcher = config.ConfigWatcher(
+        lambda configs: reload_watchlists(configs, watchlists, scheduler, reddit_config, startup_config),
+        on_error=alert_client.alert_error,
+    )
+    watcher.start()
+    if hasattr(signal, "SIGHUP"):
+        # Reload off the main thread, which is busy polling
+        signal.signal(signal.SIGHUP, lambda *_: threading.Thread(target=watcher.reload, name="config-reload").start())
+
+    logger.info("Going to stream submissions")
+    try:
+        stream_submissions(scheduler, watchlists, pipeline, reddit_config.seen_store, started)
+    except KeyboardInterrupt:
+        logger.info("Finishing in-flight posts, press Ctrl+C again to force quit")
+        pipeline.shutdown()
+        for watchlist in watchlists:
+            watchlist.alert_client.close()
+        sys.exit("\tStopping application, bye bye")
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Get notified for new Reddit posts that match your search criteria.")
+    parser.add_argument("--skip-subreddit-validation", dest="skipped_checks", action="append_const",
+                        const=config.STARTUP_CHECK_VALIDATE_SUBREDDITS, help="don't check that the subreddits exist")
+    parser.add_argument("--skip-test-alerts", dest="skipped_checks", action="append_const",
+                        const=config.STARTUP_CHECK_TEST_ALERTS, help="don't send a startup message to every alert level")
+    parser.add_argument("--skip-self-test", dest="skipped_checks", action="append_const",
+                        const=config.STARTUP_CHECK_SELF_TEST, help="don't run the test posts through the AI and alerts")
+    args = parser.parse_args()
+    args.skipped_checks = set(args.skipped_checks or [])
+    return args
+
+
+def _run_self_test(alert_client: alert.Client, ai_client: ai.Client):
     # Run tests using dummy objects
-    print("Running tests...")
+    logger.info("Running tests...")
     from test import run_tests
-    run_tests(alert_client, ai_client)
-    print("Tests completed successfully\n")
+    try:
+        run_tests(alert_client, ai_client)
+    except Exception as exception: # pylint: disable=broad-except
+        logger.exception("Tests failed")
+        alert_client.alert_error(f"Startup self test failed: {exception}")
+        return
+    logger.info("Tests completed successfully")
+
+
+def reload_watchlists(watchlist_configs: list[config.WatchlistConfig], watchlists: WatchlistIndex, scheduler: PollScheduler,
+                      reddit_config: config.RedditConfig, startup_config: config.StartupConfig):
+    """Apply reloaded watchlists to the running app, only rebuilding what changed.
+
+    Matchers are recompiled for subreddits whose terms changed, alert clients
+    only build their new Apprise targets and only shards whose subreddits
+    changed are restarted. Posts already queued are still processed.
+    Raises ValueError, before changing anything, for invalid subreddits or
+    alert targets, so the config watcher keeps the running config.
+    """
+    polled = set(watchlists.subreddits)
+    subreddits = {sub.lower() for watchlist in watchlist_configs for sub in watchlist.sub_config.subreddits}
+    added = sorted(subreddits - polled)
+    if added and startup_config.validate_subreddits:
+        invalid_subreddits = reddit_config.validate_subreddits(added, startup_config.subreddit_cache_ttl)
+        if invalid_subreddits:
+            raise ValueError("invalid subreddit: " + ", ".join(invalid_subreddits))
+
+    # Check every watchlist's alert targets first, so a bad one doesn't leave the others half updated
+    try:
+        for watchlist_config in watchlist_configs:
+            alert.check_config(watchlist_config.alert_config)
+    except RuntimeError as exception:
+        raise ValueError(f"invalid alert targets: {exception}") from exception
+
+    updated = []
+    for watchlist_config in watchlist_configs:
+        current = watchlists.get(watchlist_config.name)
+        if current is None:
+            alert_client = alert.Client(watchlist_config.alert_config, test_destinations=startup_config.test_alerts,
+                                        watchlist=watchlist_config.name)
+        else:
+            alert_client = current.alert_client
+            alert_client.update(watchlist_config.alert_config)
+        updated.append(Watchlist(watchlist_config.name, watchlist_config.sub_config, alert_client))
+
+    names = {watchlist.name for watchlist in updated}
+    removed = [watchlist for watchlist in watchlists if watchlist.name not in names]
+    changed = watchlists.update(updated)
+    for watchlist in removed:
+        watchlist.alert_client.close()
+
+    if subreddits != polled:
+        scheduler.update_subreddits(watchlists.subreddits)
+    logger.info("Config reloaded: %d watchlists, %d subreddits with changed terms", len(updated), len(changed))
+
+def stream_submissions(scheduler: PollScheduler, watchlists: WatchlistIndex, pipeline: Pipeline, seen: SeenStore, started: float):
+    """Poll new Reddit submissions and queue matches for processing.
 
-    print("Going to stream submissions")
-    stream_submissions(reddit_client, subreddits, alert_client, ai_client)
+    Posts made while the app was stopped are caught up on first, and the
+    seen store makes sure each post is only queued once.
+    `started` is the monotonic time the application started, used to log the time to the first poll.
+    """
+    logger.info("Monitoring begin")
+    scheduler.run(
+        lambda submission: queue_submission(submission, watchlists, pipeline, seen),
+        on_first_poll=lambda: logger.info("Time to first poll: %.2f seconds", time.monotonic() - started),
+    )
 
+def queue_submission(submission, watchlists: WatchlistIndex, pipeline: Pipeline, seen: SeenStore):
+    """Queue the submission for processing if it matches and hasn't been seen before."""
+    if submission.id in seen:
+        return
 
-def stream_submissions(reddit: praw.Reddit, sub_config: config.SubredditConfig, alert_client: alert.Client, ai_client: ai.Client):
-    """Monitor and process new Reddit submissions in given subreddits."""
-    subs = sub_config.subreddits
-    subs_joined = "+".join(subs)
-    subreddits_group = reddit.subreddit(subs_joined)
+    metrics.POSTS_SEEN.inc()
+    metrics.LAST_POST_TIMESTAMP.set(time.time())
 
-    print("Monitoring begin")
-    while True:
-        try:
-            for submission in subreddits_group.stream.submissions(pause_after=None, skip_existing=True):
-                process_submission(submission, sub_config, alert_client, ai_client)
+    matches = interested_watchlists(submission, watchlists)
+    if matches and not pipeline.submit(submission.id, _to_job(submission, matches)):
+        logger.info("Submission %s already queued", submission.id)
 
-        except KeyboardInterrupt:
-            sys.exit("\tStopping application, bye bye")
+    # Only marked seen once queued, the work queue drops the duplicate if we crash in between
+    seen.add(submission.id)
 
-        except (praw.exceptions.PRAWException,
-                prawcore.exceptions.PrawcoreException) as exception:
-            print("Reddit API Error: ")
-            print(exception)
-            alert_client.alert_error(exception)            
-            print("Pausing for 30 seconds...")
-            time.sleep(30)
+def process_submission(submission, watchlists: WatchlistIndex, alert_client: alert.Client, ai_client: ai.Client):
+    """Notify every watchlist the given submission matches."""
+    matches = interested_watchlists(submission, watchlists)
+    if not matches:
+        return
 
-def process_submission(submission, sub_config: config.SubredditConfig, alert_client: alert.Client, ai_client: ai.Client):
-    """Notify if given submission matches search."""
+    try:
+        notifications = evaluate_submission(submission, matches, alert_client, ai_client)
+    except ai.AIError as exception:
+        logger.error("AI request failed: %s", exception)
+        alert_client.alert_error(exception)
+        notifications = [unchecked_notification(submission, name) for name in matches]
 
-    print("checking submission: ")
+    send_notifications(notifications, watchlists)
+
+def interested_watchlists(submission, watchlists: WatchlistIndex) -> dict[str, list[str]]:
+    """Return the matched include terms for each watchlist that needs the AI to check the submission."""
+    matches = match_submission(submission, watchlists)
+    interested = {}
+    for name, terms in matches.items():
+        watchlist = watchlists.get(name)
+        # None if the watchlist was removed by a config reload since matching
+        if watchlist is not None and not screen_want_only(submission, watchlist):
+            interested[name] = terms
+    return interested
+
+def match_submission(submission, watchlists: WatchlistIndex) -> dict[str, list[str]]:
+    """Return the include terms found in the submission for each watchlist it matches."""
     title = submission.title
     body = submission.selftext
     sub = submission.subreddit.display_name
 
-    include_terms = sub_config.include_terms(sub)
-    exclude_terms = sub_config.exclude_terms(sub)
+    with metrics.MATCH_SECONDS.time():
+        matches = watchlists.match(sub, title, body)
 
-    print("include terms: ", include_terms)
-    print("exclude terms: ", exclude_terms)
-    print("submission : ", submission, title)
+    if not matches:
+        logger.debug("Submission non match: subreddit=%s title=%r", sub, title)
+    else:
+        metrics.POSTS_MATCHED.inc()
+        logger.info("Submission match: subreddit=%s terms=%s title=%r", sub, matches, title)
+    return matches
 
+def screen_want_only(submission, watchlist: Watchlist) -> bool:
+    """Handle a trade post whose title only wants the include terms, without the AI.
 
-    contains_included_term_title = not include_terms or any(term.lower() in title.lower() for term in include_terms)
-    contains_excluded_term_title = exclude_terms and any(term.lower() in title.lower() for term in exclude_terms)
+    Returns False if the post isn't one, or the subreddit leaves them to the AI.
+    """
+    action = want_only_action(submission, watchlist)
+    if action is None:
+        return False
 
-    contains_included_term_text = not include_terms or any(term.lower() in body.lower() for term in include_terms)
-    contains_excluded_term_text = exclude_terms and any(term.lower() in body.lower() for term in exclude_terms)
+    logger.info("Want-only trade post (%s) for %s: title=%r", action, watchlist.name, submission.title)
+    metrics.POSTS_WANT_ONLY.inc(action=action)
+    if action == config.WANT_ONLY_FILTER:
+        send_notification(Notification(submission.title, submission.title, submission.permalink, AlertLevel.FILTER, watchlist.name),
+                          watchlist.alert_client)
+    return True
 
-    if not ((contains_included_term_title or contains_included_term_text) and not (contains_excluded_term_title or contains_excluded_term_text)):
-        print("Submission non match")
-    elif not ai_client.check_post_valid(title, body, include_terms):
-        print("ai filtered")
-        notify(title, title, alert_client, submission.permalink, AlertLevel.FILTER)
-    else:
-        print("submission match")
+def want_only_action(submission, watchlist: Watchlist) -> str | None:
+    """The watchlist's want_only action if the submission is a trade post only wanting its include terms, else None."""
+    sub = submission.subreddit.display_name
+    action = watchlist.sub_config.want_only(sub)
+    if action is None:
+        return None
+
+    parsed = trade.parse_title(submission.title)
+    if parsed is None or not trade.wants_only(parsed, watchlist.sub_config.matcher(sub)):
+        return None
+    return action
+
+def evaluate_submission(submission, matches: dict[str, list[str]], alert_client: alert.Client, ai_client: ai.Client) -> list[Notification]:
+    """Run the AI checks for a matching submission and build a notification for each watchlist.
 
-        summarized_title = ai_client.generate_title(title, body, include_terms)        
-        if summarized_title == title:
-            alert_client.alert_error("Title Generation Failed. Check logs")    
+    Raises ai.AIError if the AI endpoint fails, so the caller can retry or give up.
+    While every endpoint is failing the AI client's degrade policy can
+    notify with the post title instead.
+    """
+    title = submission.title
+    body = submission.selftext
+
+    # Watchlists that matched the same terms get the same answer, so each distinct set is only evaluated once
+    term_sets: dict[tuple[str, ...], list[str]] = {}
+    for name, terms in matches.items():
+        term_sets.setdefault(tuple(terms), []).append(name)
+
+    try:
+        verdicts = _verdicts(title, body, [list(terms) for terms in term_sets], ai_client)
+    except ai.AIUnavailableError as exception:
+        if ai_client.degrade == config.DEGRADE_RETRY:
+            raise
+        level = AlertLevel.NOTIFY if ai_client.degrade == config.DEGRADE_NOTIFY else AlertLevel.FILTER
+        logger.warning("Notifying at %s level without the AI: %s", level.value, exception)
+        metrics.POSTS_DEGRADED.inc(level=level.value)
+        return [Notification(title, title, submission.permalink, level, name) for name in matches]
+
+    notifications = []
+    for terms, (valid, summarized_title) in zip(term_sets, verdicts):
+        if not valid:
+            logger.info("AI filtered: terms=%s title=%r", list(terms), title)
+            metrics.POSTS_AI_FILTERED.inc()
+            level, summarized_title = AlertLevel.FILTER, title
         else:
-            print(f"summarized title: {summarized_title}")
+            if summarized_title == title:
+                alert_client.alert_error("Title Generation Failed. Check logs")
+            else:
+                logger.info("Summarized title: %r", summarized_title)
+            level = AlertLevel.NOTIFY
+
+        notifications.extend(
+            Notification(summarized_title, title, submission.permalink, level, name) for name in term_sets[terms]
+        )
+    return notifications
 
-        notify(summarized_title, title, alert_client, submission.permalink, AlertLevel.NOTIFY)
+def _verdicts(title: str, body: str, term_sets: list[list[str]], ai_client: ai.Client) -> list[ai.PostVerdict]:
+    """Check the post and build its alert title for each set of matched terms.
+
+    Several sets share one batched request in combined mode, any the batch
+    couldn't answer are evaluated on their own.
+    """
+    batched = [None] * len(term_sets)
+    if ai_client.combined and len(term_sets) > 1:
+        batched = ai_client.evaluate_post_batch(title, body, term_sets)
+    return [verdict or _verdict(title, body, terms, ai_client) for verdict, terms in zip(batched, term_sets)]
+
+def _verdict(title: str, body: str, matched_terms: list[str], ai_client: ai.Client) -> ai.PostVerdict:
+    # Posts listing their items with prices get a title without the AI, which then only has to check the post
+    extracted_title = extract.sale_title(body, matched_terms)
+    verdict = ai_client.evaluate_post(title, body, matched_terms) if ai_client.combined and extracted_title is None else None
+    if verdict is not None:
+        return verdict
+
+    # Two-call path, used when the title was extracted, combined mode is off or its response was unusable
+    if not ai_client.check_post_valid(title, body, matched_terms):
+        return ai.PostVerdict(False, title)
+    if extracted_title is not None:
+        metrics.TITLES_EXTRACTED.inc()
+        return ai.PostVerdict(True, extracted_title)
+    return ai.PostVerdict(True, ai_client.generate_title(title, body, matched_terms))
+
+def unchecked_notification(submission, watchlist: str = config.DEFAULT_WATCHLIST) -> Notification:
+    """Notification for a post the AI couldn't check.
+
+    The post is still surfaced, but at the filter level so the user knows it wasn't checked.
+    """
+    return Notification(submission.title, submission.title, submission.permalink, AlertLevel.FILTER, watchlist)
+
+def _to_job(submission, matches: dict[str, list[str]]) -> dict:
+    return {
+        "submission": QueuedSubmission(submission.id, submission.title, submission.selftext, submission.permalink)._asdict(),
+        "watchlists": matches,
+    }
+
+def _from_job(payload: dict) -> tuple[QueuedSubmission, dict[str, list[str]]]:
+    # Jobs queued before watchlists only carry the default watchlist's terms
+    matches = payload.get("watchlists") or {config.DEFAULT_WATCHLIST: payload["matched_terms"]}
+    return QueuedSubmission(**payload["submission"]), matches
+
+def _give_up(payload: dict, exception: Exception, alert_client: alert.Client, watchlists: WatchlistIndex):
+    submission, matches = _from_job(payload)
+    alert_client.alert_error(f"Giving up on {submission.permalink}: {exception}")
+    send_notifications([unchecked_notification(submission, name) for name in matches], watchlists)
+
+def send_notifications(notifications: list[Notification], watchlists: WatchlistIndex):
+    for notification in notifications:
+        watchlist = watchlists.get(notification.watchlist)
+        if watchlist is None:
+            # The watchlist was removed from the config while the post was queued
+            logger.warning("Dropping notification for unknown watchlist %s: %s", notification.watchlist, notification.title)
+            continue
+        send_notification(notification, watchlist.alert_client)
+
+def send_notification(notification: Notification, alert_client: alert.Client):
+    notify(notification.title, notification.post_title, alert_client, notification.permalink, notification.alert_level)
 
 def notify(title: str, post_title:str, alert_client: alert.Client, submission_id: str, alert_level: AlertLevel):
-    print(f"Sending apprise notification")
+    metrics.POSTS_NOTIFIED.inc(level=alert_level.value)
 
     reddit_url = "https://www.reddit.com" + submission_id
     body=f'\n---\nLink to Post: [{post_title}]({reddit_url})'
-    
+
     match alert_level:
         case AlertLevel.NOTIFY:
             alert_client.notify(title, body)
@@ -106,7 +401,7 @@ def notify(title: str, post_title:str, alert_client: alert.Client, submission_id
             alert_client.notify_filtered(title, body)
         case _:
             raise ValueError(f"Only send posts to {AlertLevel.NOTIFY} and {AlertLevel.FILTER}")
-        
+
 
 
 if __name__ == "__main__":
@@ -0,0 +1,277 @@
+"""Offline scan of Reddit submission dumps against the configured watchlists.
+
+Streams a JSONL dump of submissions, optionally zstd compressed like the
+Pushshift dumps, through the keyword matchers on every core. Use it to try
+new terms against past posts, or to catch up on posts made while the app was
+down. Matching posts are written as a JSONL report. `--ai` also checks them
+with the AI and reports the alerts that would be sent, and `--replay` sends
+those alerts.
+
+    python backfill.py RS_2024-06.zst --out matches.jsonl
+    python backfill.py dump.jsonl --subreddits terms.yaml
+    python backfill.py dump.jsonl --after 1718000000 --ai --replay
+"""
+import argparse
+import io
+import itertools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import yaml
+
+import alert
+import app
+import config
+from lib import AlertLevel, Submission
+from watchlist import Watchlist, WatchlistIndex
+
+logger = logging.getLogger(__name__)
+
+_LOG_FORMAT = "%(asctime)s %(levelname)s [%(processName)s] %(name)s: %(message)s"
+
+# Lines sent to a worker at a time, enough to make the cost of passing them between processes small
+_CHUNK_LINES = 2000
+# Chunks read ahead per process, keeps every core busy without reading the whole dump into memory
+_CHUNKS_PER_PROCESS = 2
+# Pushshift dumps are compressed with a window larger than the zstandard default allows
+_ZSTD_MAX_WINDOW = 2 ** 31
+_PROGRESS_INTERVAL = 100_000
+
+
+class ReportWriter:
+    """Writes report entries as JSON lines, from any thread."""
+    def __init__(self, output):
+        self._output = output
+        self._lock = threading.Lock()
+        self.entries = 0
+
+    def write(self, entry: dict):
+        line = json.dumps(entry) + "\n"
+        with self._lock:
+            self._output.write(line)
+            self.entries += 1
+
+
+class ReportAlertClient:
+    """Stands in for a watchlist's alert client, reporting its alerts instead of sending them."""
+    def __init__(self, report: ReportWriter, watchlist: str):
+        self._report = report
+        self._watchlist = watchlist
+
+    def notify(self, title, body):
+        self._report.write({"watchlist": self._watchlist, "level": AlertLevel.NOTIFY.value, "title": title, "body": body})
+
+    def notify_filtered(self, title, body):
+        self._report.write({"watchlist": self._watchlist, "level": AlertLevel.FILTER.value, "title": title, "body": body})
+
+    def alert_error(self, exception):
+        logger.error("Error: %s", exception)
+
+    def close(self):
+        pass
+
+
+# Set in each worker process by _init_worker
+_index: WatchlistIndex | None = None
+_window: tuple[float | None, float | None] = (None, None)
+
+
+def _init_worker(watchlists: list[Watchlist], after: float | None, before: float | None):
+    global _index, _window # pylint: disable=global-statement
+    _index = WatchlistIndex(watchlists)
+    _window = (after, before)
+
+
+def _scan_chunk(lines: list[str]) -> tuple[int, int, list[tuple[dict, dict[str, list[str]]]]]:
+    """Match a chunk of dump lines, returning the posts read, the lines skipped and the matching posts.
+
+    Want-only trade posts are screened like the app does: watchlists that
+    skip them are left out, ones that filter them are listed under the
+    record's `want_only` key instead of the matches.
+    """
+    after, before = _window
+    read = skipped = 0
+    matches = []
+    for line in lines:
+        record = _record(line)
+        if record is None:
+            skipped += 1
+            continue
+        created = record["created_utc"]
+        if created is not None and ((after is not None and created < after) or (before is not None and created >= before)):
+            continue
+
+        read += 1
+        found = _index.match(record["subreddit"], record["title"], record["selftext"])
+        if not found:
+            continue
+        submission = Submission.from_record(record)
+        actions = {name: app.want_only_action(submission, _index.get(name)) for name in found}
+        found = {name: terms for name, terms in found.items() if actions[name] is None}
+        record["want_only"] = sorted(name for name, action in actions.items() if action == config.WANT_ONLY_FILTER)
+        if found or record["want_only"]:
+            matches.append((record, found))
+    return read, skipped, matches
+
+
+def _record(line: str) -> dict | None:
+    """The fields a post is matched and reported on, None for lines that aren't a submission."""
+    if not line.strip():
+        return None
+    try:
+        raw = json.loads(line)
+        record = {
+            "id": str(raw["id"]),
+            "subreddit": str(raw["subreddit"]),
+            "created_utc": float(raw["created_utc"]) if raw.get("created_utc") is not None else None,
+            "title": raw.get("title") or "",
+            "selftext": raw.get("selftext") or "",
+        }
+    except (ValueError, KeyError, TypeError):
+        return None
+    record["permalink"] = raw.get("permalink") or f"/r/{record['subreddit']}/comments/{record['id']}/"
+    return record
+
+
+def scan(dump, watchlists: list[Watchlist], processes: int, after: float | None = None, before: float | None = None):
+    """Match the dump's lines on `processes` cores, yielding the `_scan_chunk` result of each chunk in order.
+
+    Only a few chunks are read ahead of the workers, so dumps of any size
+    stream through in constant memory. Posts created outside `after` and
+    `before`, in Unix time, are skipped.
+    """
+    with ProcessPoolExecutor(processes, initializer=_init_worker, initargs=(watchlists, after, before)) as pool:
+        pending = deque()
+        while chunk := list(itertools.islice(dump, _CHUNK_LINES)):
+            pending.append(pool.submit(_scan_chunk, chunk))
+            if len(pending) >= processes * _CHUNKS_PER_PROCESS:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def open_dump(path: str):
+    """Open a JSONL dump as text, decompressing `.zst` files as they are read, `-` reads stdin."""
+    if path == "-":
+        return sys.stdin
+    if path.endswith(".zst"):
+        try:
+            import zstandard # pylint: disable=import-outside-toplevel
+        except ImportError:
+            sys.exit("Reading .zst dumps needs the zstandard package: pip install zstandard")
+        reader = zstandard.ZstdDecompressor(max_window_size=_ZSTD_MAX_WINDOW).stream_reader(open(path, "rb")) # pylint: disable=consider-using-with
+        return io.TextIOWrapper(reader, encoding="utf-8", errors="replace")
+    return open(path, "r", encoding="utf-8", errors="replace") # pylint: disable=consider-using-with
+
+
+class _Checker:
+    """Runs matching posts through `app.process_submission` on a bounded number of threads."""
+    def __init__(self, watchlists: WatchlistIndex, ai_client, concurrency: int):
+        self._watchlists = watchlists
+        self._ai_client = ai_client
+        self._errors = watchlists.get(config.DEFAULT_WATCHLIST).alert_client
+        self._executor = ThreadPoolExecutor(concurrency, thread_name_prefix="check")
+        # Stop reading the dump while the AI is behind, rather than queueing every match
+        self._slots = threading.BoundedSemaphore(concurrency * 2)
+
+    def submit(self, record: dict):
+        self._slots.acquire() # pylint: disable=consider-using-with
+        future = self._executor.submit(app.process_submission, Submission.from_record(record), self._watchlists, self._errors, self._ai_client)
+        future.add_done_callback(self._done)
+
+    def _done(self, future):
+        self._slots.release()
+        if future.exception() is not None:
+            logger.error("Failed to check post: %s", future.exception())
+
+    def close(self):
+        self._executor.shutdown()
+
+
+def run(args) -> dict:
+    if args.subreddits:
+        with open(args.subreddits, "r", encoding="utf-8") as subreddits_yaml:
+            watchlist_configs = [config.WatchlistConfig(config.DEFAULT_WATCHLIST, {config.YAML_KEY_SUBREDDITS: yaml.safe_load(subreddits_yaml)})]
+    else:
+        watchlist_configs = config.load_watchlists()
+    matchers = [Watchlist(watchlist.name, watchlist.sub_config, None) for watchlist in watchlist_configs]
+
+    output = open(args.out, "w", encoding="utf-8") if args.out else sys.stdout # pylint: disable=consider-using-with
+    report = ReportWriter(output)
+    checker = None
+    if args.ai:
+        if args.replay:
+            # Alert targets come from the config file, even when trying other terms
+            alert_configs = {watchlist.name: watchlist.alert_config for watchlist in config.load_watchlists()}
+            alert_clients = {name: alert.Client(alert_configs.get(name, config.AlertConfig({})), test_destinations=False, watchlist=name)
+                             for name in (watchlist.name for watchlist in watchlist_configs)}
+        else:
+            alert_clients = {watchlist.name: ReportAlertClient(report, watchlist.name) for watchlist in watchlist_configs}
+        watchlists = WatchlistIndex([Watchlist(watchlist.name, watchlist.sub_config, alert_clients[watchlist.name])
+                                     for watchlist in watchlist_configs])
+        checker = _Checker(watchlists, config.load_ai_config().client, args.concurrency)
+
+    read = skipped = matched = 0
+    started = time.perf_counter()
+    with open_dump(args.dump) as dump:
+        for chunk_read, chunk_skipped, matches in scan(dump, matchers, args.processes, args.after, args.before):
+            if (read + chunk_read) // _PROGRESS_INTERVAL > read // _PROGRESS_INTERVAL:
+                logger.info("Scanned %d posts, %d matched", read + chunk_read, matched + len(matches))
+            read += chunk_read
+            skipped += chunk_skipped
+            matched += len(matches)
+            for record, found in matches:
+                if checker is not None:
+                    checker.submit(record)
+                else:
+                    report.write({**{key: record[key] for key in ("id", "subreddit", "created_utc", "title", "permalink", "want_only")},
+                                  "watchlists": found})
+
+    if checker is not None:
+        checker.close()
+        for watchlist in watchlists:
+            watchlist.alert_client.close()
+    elapsed = time.perf_counter() - started
+    if args.out:
+        output.close()
+
+    return {
+        "posts": read,
+        "skipped_lines": skipped,
+        "matched": matched,
+        "reported": report.entries,
+        "seconds": elapsed,
+        "posts_per_second": read / elapsed if elapsed else 0,
+    }
+
+
+def main():
+    logging.basicConfig(level=os.getenv("RPN_LOG_LEVEL", "INFO").upper(), format=_LOG_FORMAT)
+    parser = argparse.ArgumentParser(description="Match a dump of Reddit submissions against your watchlists.")
+    parser.add_argument("dump", help="JSONL file with id, subreddit, title, selftext and optionally permalink and created_utc "
+                                     "per line, compressed if it ends in .zst, - for stdin")
+    parser.add_argument("--subreddits", help="YAML file of subreddit include/exclude terms to try instead of the configured watchlists")
+    parser.add_argument("--out", help="where to write the JSONL report, defaults to stdout")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1, help="processes matching posts, defaults to one per core")
+    parser.add_argument("--after", type=float, help="skip posts created before this Unix time")
+    parser.add_argument("--before", type=float, help="skip posts created at or after this Unix time")
+    parser.add_argument("--ai", action="store_true", help="check matches with the AI and report the alerts that would be sent")
+    parser.add_argument("--replay", action="store_true", help="send the alerts instead of reporting them, implies --ai")
+    parser.add_argument("--concurrency", type=int, default=8, help="posts checked with the AI at once")
+    args = parser.parse_args()
+    args.ai = args.ai or args.replay
+
+    results = run(args)
+    print(f"Scanned {results['posts']} posts in {results['seconds']:.1f}s ({results['posts_per_second']:.0f} posts/s), "
+          f"{results['matched']} matched, {results['reported']} reported, {results['skipped_lines']} lines skipped",
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Adaptive micro-batching of concurrent calls."""
+import threading
+
+
+class _Batch:
+    def __init__(self):
+        self.items = []
+        self.results = None
+        self.error: Exception | None = None
+        self.full = threading.Event()
+        self.done = threading.Event()
+
+
+class MicroBatcher:
+    """Group calls made from several threads into one `send_batch` call.
+
+    A call made while no other call is running is sent on its own straight
+    away. Once calls overlap, a new call opens a batch and waits up to
+    `max_wait` seconds for others to join it, or until it holds `max_size`
+    items. `send_batch` takes a list of items and returns a result for each,
+    in order. If it raises, every caller in the batch gets the exception.
+    """
+    def __init__(self, send_batch, max_size: int, max_wait: float):
+        self._send_batch = send_batch
+        self._max_size = max_size
+        self._max_wait = max_wait
+        self._lock = threading.Lock()
+        self._open: _Batch | None = None
+        self._running = 0
+
+    def submit(self, item):
+        """Add the item to a batch and block until its result is ready."""
+        with self._lock:
+            batch = self._open
+            leader = batch is None
+            if leader:
+                batch = _Batch()
+                # Only wait for company when other calls are already in progress
+                if self._running and self._max_size > 1:
+                    self._open = batch
+            index = len(batch.items)
+            batch.items.append(item)
+            if len(batch.items) >= self._max_size:
+                self._close(batch)
+            wait = self._max_wait if self._open is batch else 0
+            self._running += 1
+
+        try:
+            if leader:
+                batch.full.wait(wait)
+                with self._lock:
+                    self._close(batch)
+                self._run(batch)
+            else:
+                batch.done.wait()
+        finally:
+            with self._lock:
+                self._running -= 1
+
+        if batch.error is not None:
+            raise batch.error
+        return batch.results[index]
+
+    def _close(self, batch: _Batch):
+        if self._open is batch:
+            self._open = None
+        batch.full.set()
+
+    def _run(self, batch: _Batch):
+        try:
+            batch.results = self._send_batch(batch.items)
+        except Exception as exception: # pylint: disable=broad-except
+            batch.error = exception
+        finally:
+            batch.done.set()
@@ -0,0 +1,399 @@
+"""Replay benchmark for the matching, AI and alert stages.
+
+Replays a JSONL corpus of submissions through `app.process_submission` or the
+streaming pipeline, against a local fake LLM server and a capturing alert
+client, so no Reddit, LLM or Apprise traffic is generated.
+
+    python bench.py run --synthetic 500 --latency 0.2 --mode stream
+    python bench.py run --corpus corpus.jsonl --compare bench_results/abc1234.json
+    python bench.py record --out corpus.jsonl --limit 1000
+"""
+import argparse
+import json
+import os
+import random
+import re
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import yaml
+
+import ai
+import app
+import config
+from lib import Submission
+from pipeline import Pipeline
+from scheduler import PollScheduler
+from seen import SeenStore
+from watchlist import Watchlist, WatchlistIndex
+from workqueue import WorkQueue
+
+_RESULTS_DIR = "bench_results"
+
+_DEFAULT_SUBREDDITS = {
+    "hardwareswap": {"include": ["5080", "4090", "ssd", "3090"], "exclude": ["broken"]},
+    "buildapcsales": {"include": ["monitor", "ssd"], "exclude": []},
+}
+
+_ITEMS = [
+    ("RTX 5080 FE", 1200), ("RTX 4090 TUF", 1600), ("Samsung 990 Pro 2TB SSD", 150), ("RTX 3090 Ti FE", 800),
+    ("LG 27GP950 monitor", 450), ("Ryzen 7 7800X3D", 330), ("Corsair DDR5 32GB", 90), ("Asus Z690I Strix", 140),
+]
+
+
+class FakeLLMServer:
+    """OpenAI-compatible endpoint with configurable latency and error injection."""
+    def __init__(self, latency: float, jitter: float, error_rate: float):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.calls = 0
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def respond(self, prompt: str) -> str:
+        if "numbered posts" in prompt:
+            numbers = re.findall(r"^\s*Post (\d+)$", prompt, re.MULTILINE)
+            return json.dumps({number: {"valid": True, "title": "RTX 5080 FE - $1200"} for number in numbers})
+        if "each numbered list" in prompt:
+            numbers = re.findall(r"^\s*(\d+): \[", prompt, re.MULTILINE)
+            return json.dumps({number: {"valid": True, "title": "RTX 5080 FE - $1200"} for number in numbers})
+        if '"valid"' in prompt:
+            return json.dumps({"valid": True, "title": "RTX 5080 FE - $1200"})
+        if "True or False" in prompt:
+            return "True"
+        return "RTX 5080 FE - $1200"
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body are written separately, Nagle would add a delayed-ACK stall to every response
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with fake._lock:
+                    fake.calls += 1
+
+                time.sleep(max(0, random.gauss(fake.latency, fake.jitter)))
+                if random.random() < fake.error_rate:
+                    status, payload = 503, b"injected error"
+                else:
+                    prompt = "\n".join(message["content"] for message in request["messages"])
+                    content = fake.respond(prompt)
+                    status, payload = 200, json.dumps({"choices": [{"message": {"content": content}}]}).encode()
+
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+class CaptureAlertClient:
+    """Stands in for alert.Client and records alerts instead of sending them."""
+    def __init__(self):
+        self.alerts = []
+        self.errors = []
+
+    def notify(self, title, body):
+        self.alerts.append(("notify", title))
+
+    def notify_filtered(self, title, body):
+        self.alerts.append(("filter", title))
+
+    def alert_error(self, exception):
+        self.errors.append(str(exception))
+
+    def close(self):
+        pass
+
+
+class StageTimer:
+    """Wraps app stage functions to record per-stage CPU time and end-to-end latency."""
+    def __init__(self):
+        self.cpu = {}
+        self.ingested = {}
+        self.latencies = []
+        self._lock = threading.Lock()
+
+    def wrap(self, stage: str, function):
+        def timed(*args, **kwargs):
+            started = time.thread_time()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.cpu[stage] = self.cpu.get(stage, 0) + time.thread_time() - started
+        return timed
+
+    def ingest(self, submission):
+        self.ingested[submission.permalink] = time.perf_counter()
+
+    def delivered(self, notification):
+        with self._lock:
+            self.latencies.append(time.perf_counter() - self.ingested[notification.permalink])
+
+
+class _CorpusExhausted(Exception):
+    """Ends the streaming loop once the corpus has been replayed."""
+
+
+class FakeReddit:
+    """Serves the corpus as subreddit listings, releasing a few posts before each poll."""
+    def __init__(self, submissions: list[Submission], timer: StageTimer, posts_per_poll: int = 20):
+        self._submissions = submissions
+        self._timer = timer
+        self._posts_per_poll = posts_per_poll
+        self._released = 0
+        self.auth = SimpleNamespace(limits={"remaining": 1_000_000, "reset_timestamp": time.time() + 600, "used": 0})
+
+    def subreddit(self, name):
+        return self
+
+    def new(self, limit):
+        if self._released >= len(self._submissions):
+            raise _CorpusExhausted()
+
+        released = self._submissions[self._released:self._released + self._posts_per_poll]
+        for submission in released:
+            self._timer.ingest(submission)
+        self._released += len(released)
+        return list(reversed(self._submissions[max(0, self._released - limit):self._released]))
+
+
+def load_corpus(path: str) -> list[Submission]:
+    with open(path, "r", encoding="utf-8") as corpus:
+        return [Submission.from_record(json.loads(line)) for line in corpus if line.strip()]
+
+
+def synthetic_corpus(count: int, subreddits: dict, seed: int = 0) -> list[Submission]:
+    """Generate sale posts shaped like r/hardwareswap listings."""
+    rng = random.Random(seed)
+    records = []
+    for i in range(count):
+        items = rng.sample(_ITEMS, rng.randint(1, 4))
+        title = f"[USA-CA] [H] {', '.join(name for name, _ in items)} [W] PayPal, Local Cash"
+        rows = "\n".join(f"|{name}|Used|${price} shipped|" for name, price in items)
+        body = f"|Item|Condition|Price|\n|:-|:-|:-|\n{rows}\n\n&amp;nbsp;\n\nLocal is 94587, timestamps in comments."
+        records.append({
+            "id": f"bench{i}",
+            "title": title,
+            "selftext": body,
+            "subreddit": rng.choice(list(subreddits)),
+            "permalink": f"/r/bench/comments/bench{i}/",
+        })
+    return [Submission.from_record(record) for record in records]
+
+
+def run(args) -> dict:
+    subreddits = _DEFAULT_SUBREDDITS
+    if args.subreddits:
+        with open(args.subreddits, "r", encoding="utf-8") as subreddits_yaml:
+            subreddits = yaml.safe_load(subreddits_yaml)
+    sub_config = config.SubredditConfig(subreddits)
+
+    submissions = load_corpus(args.corpus) if args.corpus else synthetic_corpus(args.synthetic, subreddits)
+    timer = StageTimer()
+    alert_client = CaptureAlertClient()
+    watchlists = WatchlistIndex([Watchlist(config.DEFAULT_WATCHLIST, sub_config, alert_client)])
+
+    # Patch the stages at module level so both modes are measured the same way
+    send_notification = app.send_notification
+    app.match_submission = timer.wrap("match", app.match_submission)
+    app.evaluate_submission = timer.wrap("ai", app.evaluate_submission)
+    app.send_notification = timer.wrap("alert", lambda notification, client: (
+        timer.delivered(notification), send_notification(notification, client)))
+
+    with FakeLLMServer(args.latency, args.jitter, args.error_rate) as llm:
+        ai_client = ai.Client(url=llm.url, api_key="bench", model="bench", combined=args.combined,
+                              backoff=0.01, pool_size=args.workers, batch_size=args.batch_size)
+
+        cpu_started = time.process_time()
+        started = time.perf_counter()
+        if args.mode == "process":
+            _run_process(submissions, watchlists, alert_client, ai_client, timer)
+        else:
+            _run_stream(submissions, watchlists, alert_client, ai_client, timer, args.workers)
+        elapsed = time.perf_counter() - started
+        cpu = time.process_time() - cpu_started
+
+    latencies = sorted(timer.latencies)
+    return {
+        "commit": _git_commit(),
+        "mode": args.mode,
+        "combined": args.combined,
+        "workers": args.workers,
+        "batch_size": args.batch_size,
+        "llm_latency": args.latency,
+        "error_rate": args.error_rate,
+        "posts": len(submissions),
+        "alerts": len(alert_client.alerts),
+        "errors": len(alert_client.errors),
+        "seconds": elapsed,
+        "posts_per_second": len(submissions) / elapsed if elapsed else 0,
+        "latency_p50": _percentile(latencies, 50),
+        "latency_p95": _percentile(latencies, 95),
+        "latency_p99": _percentile(latencies, 99),
+        "llm_calls_per_post": llm.calls / len(submissions) if submissions else 0,
+        "cpu_seconds": cpu,
+        "cpu_seconds_per_stage": timer.cpu,
+    }
+
+
+def _run_process(submissions, watchlists, alert_client, ai_client, timer: StageTimer):
+    for submission in submissions:
+        timer.ingest(submission)
+        app.process_submission(submission, watchlists, alert_client, ai_client)
+
+
+def _run_stream(submissions, watchlists, alert_client, ai_client, timer: StageTimer, workers: int):
+    work_queue = WorkQueue(path=None, max_pending=100, max_attempts=3, backoff=0.05)
+    pipeline = Pipeline(
+        work_queue=work_queue,
+        evaluate=lambda payload: app.evaluate_submission(*app._from_job(payload), alert_client, ai_client), # pylint: disable=protected-access
+        deliver=lambda notifications: app.send_notifications(notifications, watchlists),
+        on_error=alert_client.alert_error,
+        on_dead=lambda payload, exception: alert_client.alert_error(exception),
+        workers=workers,
+    )
+    pipeline.start()
+
+    seen = SeenStore(None, len(submissions) + 1)
+    # Seed the seen store so the first poll is treated as a restart rather than a first run
+    seen.add("bench-start")
+    scheduler = PollScheduler(FakeReddit(submissions, timer), watchlists.subreddits, seen, catch_up_limit=0,
+                              shard_size=25, min_interval=0, max_interval=0, on_error=alert_client.alert_error)
+    try:
+        app.stream_submissions(scheduler, watchlists, pipeline, seen, time.monotonic())
+    except _CorpusExhausted:
+        pass
+
+    while (counts := work_queue.counts())["pending"] or counts["in_progress"]:
+        time.sleep(0.01)
+    pipeline.shutdown()
+
+
+def record(args):
+    """Save recent posts from the configured subreddits as a corpus."""
+    import praw
+
+    reddit_yaml = config._get_config()[config.YAML_KEY_REDDIT] # pylint: disable=protected-access
+    reddit = praw.Reddit(
+        client_id=reddit_yaml[config.YAML_KEY_CLIENT],
+        client_secret=reddit_yaml[config.YAML_KEY_SECRET],
+        user_agent=reddit_yaml[config.YAML_KEY_AGENT],
+    )
+    subreddits = "+".join(reddit_yaml[config.YAML_KEY_SUBREDDITS])
+
+    count = 0
+    with open(args.out, "w", encoding="utf-8") as corpus:
+        for count, submission in enumerate(reddit.subreddit(subreddits).new(limit=args.limit), start=1):
+            corpus.write(json.dumps({
+                "id": submission.id,
+                "title": submission.title,
+                "selftext": submission.selftext,
+                "subreddit": submission.subreddit.display_name,
+                "permalink": submission.permalink,
+            }) + "\n")
+    print(f"Recorded {count} posts to {args.out}")
+
+
+def _percentile(values: list[float], percent: int) -> float | None:
+    if not values:
+        return None
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[percent - 1]
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _print_results(results: dict, baseline: dict | None):
+    for key, value in results.items():
+        line = f"{key:>22}: {_format(value)}"
+        if baseline and isinstance(value, (int, float)) and isinstance(baseline.get(key), (int, float)) and baseline[key]:
+            line += f"  ({(value - baseline[key]) / baseline[key]:+.1%} vs {baseline.get('commit')})"
+        print(line)
+
+
+def _format(value) -> str:
+    if isinstance(value, float):
+        return f"{value:.4f}"
+    if isinstance(value, dict):
+        return ", ".join(f"{key}={_format(inner)}" for key, inner in value.items())
+    return str(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Reddit Post Notifier against local stand-ins.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="replay a corpus and report throughput and latency")
+    source = run_parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--corpus", help="JSONL file with id, title, selftext, subreddit and permalink per line")
+    source.add_argument("--synthetic", type=int, help="generate this many synthetic sale posts instead")
+    run_parser.add_argument("--subreddits", help="YAML file of subreddit include/exclude terms, like reddit.subreddits in config.yaml")
+    run_parser.add_argument("--mode", choices=("process", "stream"), default="stream")
+    run_parser.add_argument("--workers", type=int, default=4)
+    run_parser.add_argument("--combined", action=argparse.BooleanOptionalAction, default=True)
+    run_parser.add_argument("--batch-size", type=int, default=1, help="posts per batched AI request, 1 turns batching off")
+    run_parser.add_argument("--latency", type=float, default=0.5, help="mean fake LLM latency in seconds")
+    run_parser.add_argument("--jitter", type=float, default=0.1, help="standard deviation of the fake LLM latency")
+    run_parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of fake LLM requests that return 503")
+    run_parser.add_argument("--output", help=f"where to save results, defaults to {_RESULTS_DIR}/<commit>.json")
+    run_parser.add_argument("--compare", help="results file to compare against")
+
+    record_parser = commands.add_parser("record", help="record recent posts from the configured subreddits")
+    record_parser.add_argument("--out", required=True)
+    record_parser.add_argument("--limit", type=int, default=1000)
+
+    args = parser.parse_args()
+    if args.command == "record":
+        record(args)
+        return
+
+    results = run(args)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)
+    _print_results(results, baseline)
+
+    output = args.output or os.path.join(_RESULTS_DIR, f"{results['commit']}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as output_file:
+        json.dump(results, output_file, indent=2)
+    print(f"Saved results to {output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Content-addressed cache for LLM responses."""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+# How many writes between sweeps of expired and excess rows on disk
+_PRUNE_INTERVAL = 100
+
+
+def normalize(text: str) -> str:
+    """Fold case and whitespace so reposts with cosmetic edits share a key."""
+    return " ".join(text.lower().split())
+
+
+def cache_key(model: str, kind: str, title: str, body: str, include_terms: list[str]) -> str:
+    """Hash everything that affects a model response into a stable key."""
+    payload = json.dumps([
+        model,
+        kind,
+        normalize(title),
+        normalize(body),
+        sorted({term.lower() for term in include_terms}),
+    ])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """In-memory LRU in front of an optional SQLite store, with TTL expiry.
+
+    Safe to share between pipeline worker threads.
+    """
+    def __init__(self, path: str | None, memory_size: int, disk_size: int, ttl: float):
+        self._memory_size = memory_size
+        self._disk_size = disk_size
+        self._ttl = ttl
+
+        self._memory: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+
+        self.hits = 0
+        self.misses = 0
+
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)"
+            )
+            self._db.commit()
+            self._prune()
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None and self._db is not None:
+                entry = self._db.execute(
+                    "SELECT value, expires FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+
+            if entry is None or entry[1] < now:
+                self._memory.pop(key, None)
+                self.misses += 1
+                metrics.AI_CACHE_REQUESTS.inc(result="miss")
+                return None
+
+            self._remember(key, entry)
+            self.hits += 1
+            metrics.AI_CACHE_REQUESTS.inc(result="hit")
+            return entry[0]
+
+    def put(self, key: str, value: str):
+        entry = (value, time.time() + self._ttl)
+        with self._lock:
+            self._remember(key, entry)
+            if self._db is None:
+                return
+
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, value, expires) VALUES (?, ?, ?)",
+                (key, *entry),
+            )
+            self._db.commit()
+
+            self._writes += 1
+            if self._writes % _PRUNE_INTERVAL == 0:
+                self._prune()
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        ratio = self.hits / total if total else 0
+        return f"AI cache: {self.hits} hits, {self.misses} misses ({ratio:.0%} hit rate)"
+
+    def _remember(self, key: str, entry: tuple[str, float]):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self._memory_size:
+            self._memory.popitem(last=False)
+
+    def _prune(self):
+        """Drop expired rows, then the soonest-to-expire rows beyond the size limit."""
+        self._db.execute("DELETE FROM responses WHERE expires < ?", (time.time(),))
+        self._db.execute(
+            "DELETE FROM responses WHERE key NOT IN "
+            "(SELECT key FROM responses ORDER BY expires DESC LIMIT ?)",
+            (self._disk_size,),
+        )
+        self._db.commit()
@@ -1,14 +1,27 @@
+import json
+import logging
 import os
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import yaml
 import praw
 import prawcore
 
 import ai
+from cache import ResponseCache
+import metrics
 from lib import AlertLevel
+from matcher import TermMatcher
+from seen import SeenStore
+from workqueue import WorkQueue
+
+logger = logging.getLogger(__name__)
 
 _CONFIG_PATH = os.getenv("RPN_CONFIG", "config.yaml")
+_DATA_DIR = os.getenv("RPN_DATA_DIR", ".")
 
 YAML_KEY_APPRISE = "apprise"
 
@@ -16,21 +29,144 @@ YAML_KEY_AI = "openai"
 YAML_KEY_CLIENT = "client"
 YAML_KEY_SECRET = "secret"
 YAML_KEY_AGENT = "agent"
+YAML_KEY_AI_COMBINED = "combined"
+YAML_KEY_AI_CACHE = "cache"
+YAML_KEY_CACHE_PATH = "path"
+YAML_KEY_CACHE_MEMORY_SIZE = "memory_size"
+YAML_KEY_CACHE_DISK_SIZE = "disk_size"
+YAML_KEY_CACHE_TTL = "ttl"
+YAML_KEY_AI_TIMEOUT = "timeout"
+YAML_KEY_TIMEOUT_CONNECT = "connect"
+YAML_KEY_TIMEOUT_READ = "read"
+YAML_KEY_AI_RETRIES = "retries"
+YAML_KEY_AI_TOKEN_BUDGET = "token_budget"
+YAML_KEY_AI_BATCH = "batch"
+YAML_KEY_BATCH_SIZE = "size"
+YAML_KEY_BATCH_WAIT = "wait"
+YAML_KEY_AI_FALLBACKS = "fallbacks"
+YAML_KEY_AI_CIRCUIT = "circuit"
+YAML_KEY_CIRCUIT_FAILURES = "failures"
+YAML_KEY_CIRCUIT_COOLDOWN = "cooldown"
+YAML_KEY_AI_HEDGE_PERCENTILE = "hedge_percentile"
+YAML_KEY_AI_DEGRADE = "degrade"
+# While every AI endpoint is failing: retry through the work queue, or notify with the post title at a level
+DEGRADE_RETRY = "retry"
+DEGRADE_FILTER = "filter"
+DEGRADE_NOTIFY = "notify"
+DEGRADE_POLICIES = (DEGRADE_RETRY, DEGRADE_FILTER, DEGRADE_NOTIFY)
 
 YAML_KEY_REDDIT = "reddit"
 YAML_KEY_SUBREDDITS = "subreddits"
 YAML_KEY_SUBREDDITS_INCLUDE = "include"
 YAML_KEY_SUBREDDITS_EXCLUDE = "exclude"
+YAML_KEY_SUBREDDITS_WANT_ONLY = "want_only"
+WANT_ONLY_FILTER = "filter"
+WANT_ONLY_SKIP = "skip"
+YAML_KEY_REDDIT_SEEN_SIZE = "seen_size"
+YAML_KEY_REDDIT_CATCH_UP_LIMIT = "catch_up_limit"
+YAML_KEY_REDDIT_SHARD_SIZE = "shard_size"
+YAML_KEY_REDDIT_MIN_POLL_INTERVAL = "min_poll_interval"
+YAML_KEY_REDDIT_MAX_POLL_INTERVAL = "max_poll_interval"
+
+_SEEN_STORE_FILE = "seen.db"
+
+YAML_KEY_STARTUP = "startup"
+YAML_KEY_STARTUP_SUBREDDIT_CACHE_TTL = "subreddit_cache_ttl"
+
+STARTUP_CHECK_VALIDATE_SUBREDDITS = "validate_subreddits"
+STARTUP_CHECK_TEST_ALERTS = "test_alerts"
+STARTUP_CHECK_SELF_TEST = "self_test"
+STARTUP_CHECKS = (STARTUP_CHECK_VALIDATE_SUBREDDITS, STARTUP_CHECK_TEST_ALERTS, STARTUP_CHECK_SELF_TEST)
+
+_SUBREDDIT_CACHE_FILE = "subreddits.json"
+
+YAML_KEY_WATCHLISTS = "watchlists"
+# Name of the watchlist made from `reddit.subreddits` and `apprise`
+DEFAULT_WATCHLIST = "default"
+
+# Seconds between checks of the config file for changes
+_WATCH_INTERVAL = 1
+
+YAML_KEY_METRICS = "metrics"
+YAML_KEY_METRICS_HOST = "host"
+YAML_KEY_METRICS_PORT = "port"
+
+YAML_KEY_PIPELINE = "pipeline"
+YAML_KEY_PIPELINE_WORKERS = "workers"
+YAML_KEY_PIPELINE_QUEUE_SIZE = "queue_size"
+YAML_KEY_PIPELINE_QUEUE_PATH = "queue_path"
+YAML_KEY_PIPELINE_MAX_ATTEMPTS = "max_attempts"
+YAML_KEY_PIPELINE_RETRY_BACKOFF = "retry_backoff"
 
 class AIConfig:
     def __init__(self, ai_config: dict[str, str]):
         self._url = ai_config[YAML_KEY_CLIENT]
         self._model = ai_config[YAML_KEY_AGENT]
+        self._combined = bool(ai_config.get(YAML_KEY_AI_COMBINED, True))
+        self._cache_config = ai_config.get(YAML_KEY_AI_CACHE, {})
+        timeout_config = ai_config.get(YAML_KEY_AI_TIMEOUT) or {}
+        self._timeout = (
+            float(timeout_config.get(YAML_KEY_TIMEOUT_CONNECT, 5)),
+            float(timeout_config.get(YAML_KEY_TIMEOUT_READ, 60)),
+        )
+        self._retries = int(ai_config.get(YAML_KEY_AI_RETRIES, 3))
+        self._token_budget = int(ai_config.get(YAML_KEY_AI_TOKEN_BUDGET, 800))
+        batch_config = ai_config.get(YAML_KEY_AI_BATCH) or {}
+        self._batch_size = int(batch_config.get(YAML_KEY_BATCH_SIZE, 5))
+        self._batch_wait = float(batch_config.get(YAML_KEY_BATCH_WAIT, 0.05))
+        # Fallback endpoints share the first one's key and model unless they set their own
+        self._fallbacks = [
+            (
+                fallback[YAML_KEY_CLIENT],
+                fallback.get(YAML_KEY_SECRET, ai_config[YAML_KEY_SECRET]),
+                fallback.get(YAML_KEY_AGENT, self._model),
+            )
+            for fallback in ai_config.get(YAML_KEY_AI_FALLBACKS) or []
+        ]
+        circuit_config = ai_config.get(YAML_KEY_AI_CIRCUIT) or {}
+        self._circuit = (
+            int(circuit_config.get(YAML_KEY_CIRCUIT_FAILURES, 3)),
+            float(circuit_config.get(YAML_KEY_CIRCUIT_COOLDOWN, 30)),
+        )
+        hedge_percentile = ai_config.get(YAML_KEY_AI_HEDGE_PERCENTILE)
+        self._hedge_percentile = float(hedge_percentile) if hedge_percentile is not None else None
+        if self._hedge_percentile is not None and not 0 < self._hedge_percentile < 100:
+            sys.exit("Invalid config: openai.hedge_percentile must be between 0 and 100")
+        self._degrade = ai_config.get(YAML_KEY_AI_DEGRADE, DEGRADE_RETRY)
+        if self._degrade not in DEGRADE_POLICIES:
+            sys.exit(f"Invalid config: openai.degrade must be one of {', '.join(DEGRADE_POLICIES)}")
 
         self._client = ai.Client(
             url=self._url,
             api_key=ai_config[YAML_KEY_SECRET],
             model=self._model,
+            combined=self._combined,
+            cache=self._build_cache(),
+            connect_timeout=self._timeout[0],
+            read_timeout=self._timeout[1],
+            max_retries=self._retries,
+            token_budget=self._token_budget,
+            batch_size=self._batch_size,
+            batch_wait=self._batch_wait,
+            fallbacks=self._fallbacks,
+            failure_threshold=self._circuit[0],
+            cooldown=self._circuit[1],
+            hedge_percentile=self._hedge_percentile,
+            degrade=self._degrade,
+        )
+
+    def _build_cache(self) -> ResponseCache | None:
+        """Build the response cache, `cache: false` turns it off."""
+        if self._cache_config is False:
+            return None
+
+        cache_config = self._cache_config or {}
+        path = cache_config.get(YAML_KEY_CACHE_PATH, "ai_cache.db")
+        return ResponseCache(
+            path=os.path.join(_DATA_DIR, path) if path else None,
+            memory_size=int(cache_config.get(YAML_KEY_CACHE_MEMORY_SIZE, 1024)),
+            disk_size=int(cache_config.get(YAML_KEY_CACHE_DISK_SIZE, 100_000)),
+            ttl=float(cache_config.get(YAML_KEY_CACHE_TTL, 7 * 24 * 60 * 60)),
         )
 
     @property
@@ -42,48 +178,109 @@ class AIConfig:
             AIConfig:
             Url: {self._url}
             Model: {self._model}
+            Combined Requests: {self._combined}
+            Cache: {self._cache_config}
+            Timeout (connect, read): {self._timeout}
+            Retries: {self._retries}
+            Body Token Budget: {self._token_budget}
+            Batch (size, wait): {(self._batch_size, self._batch_wait)}
+            Fallbacks (url, model): {[(url, model) for url, _, model in self._fallbacks]}
+            Circuit (failures, cooldown): {self._circuit}
+            Hedge Percentile: {self._hedge_percentile}
+            Degrade: {self._degrade}
         """
 
 class SubredditConfig:
     def __init__(self, subreddit_config):
-        self._subreddit_config = {k.lower(): v for k, v in subreddit_config.items()}
+        # An empty `include:` or `exclude:` key, or a subreddit with no keys at all, means no terms
+        self._subreddit_config = {k.lower(): v or {} for k, v in subreddit_config.items()}
+        for sub in self._subreddit_config:
+            if self.want_only(sub) not in (None, WANT_ONLY_FILTER, WANT_ONLY_SKIP):
+                sys.exit(f"Invalid config: {sub} want_only must be {WANT_ONLY_FILTER} or {WANT_ONLY_SKIP}")
+        # Posts are matched by watchlist.WatchlistIndex, these only check trade titles for want_only subreddits
+        self._matchers = {
+            sub: TermMatcher(self.include_terms(sub))
+            for sub in self._subreddit_config if self.want_only(sub) is not None
+        }
     
     @property
     def subreddits(self) -> set[str]:
         return self._subreddit_config.keys()
     
     def include_terms(self, subreddit: str) -> list[str]:
-        return self._subreddit_config[subreddit.lower()].get(YAML_KEY_SUBREDDITS_INCLUDE, [])
+        return self._subreddit_config[subreddit.lower()].get(YAML_KEY_SUBREDDITS_INCLUDE) or []
     
     def exclude_terms(self, subreddit: str) -> list[str]:
-        return self._subreddit_config[subreddit.lower()].get(YAML_KEY_SUBREDDITS_EXCLUDE, [])
+        return self._subreddit_config[subreddit.lower()].get(YAML_KEY_SUBREDDITS_EXCLUDE) or []
+
+    def want_only(self, subreddit: str) -> str | None:
+        """How trade posts that only want the include terms are handled, None leaves them to the AI."""
+        return self._subreddit_config[subreddit.lower()].get(YAML_KEY_SUBREDDITS_WANT_ONLY)
+
+    def matcher(self, subreddit: str) -> TermMatcher:
+        """The include terms of a subreddit with `want_only` set, to find them in trade titles."""
+        return self._matchers[subreddit.lower()]
     
     def __str__(self):
         sub_str = """
             {subreddit}: 
                 Include Terms: {include_terms}, 
-                Exclude Terms: {exclude_terms}
+                Exclude Terms: {exclude_terms},
+                Want Only: {want_only}
         """
         return f"""
             Subreddit Config: 
-            {[sub_str.format(subreddit = sub, include_terms = self.include_terms(sub), exclude_terms = self.exclude_terms(sub)) for sub in self.subreddits]}
+            {[sub_str.format(subreddit = sub, include_terms = self.include_terms(sub), exclude_terms = self.exclude_terms(sub), want_only = self.want_only(sub)) for sub in self.subreddits]}
         """
         
 
+class _TimedRequestor(prawcore.Requestor):
+    """Requestor that records how long each Reddit API request takes."""
+    def request(self, *args, **kwargs):
+        with metrics.REDDIT_REQUEST_SECONDS.time():
+            return super().request(*args, **kwargs)
+
 class RedditConfig:
     def __init__(self, reddit_config: dict[str, str]):
         self._cid = reddit_config[YAML_KEY_CLIENT]
         secret = reddit_config[YAML_KEY_SECRET]
         self._agent = reddit_config[YAML_KEY_AGENT]
 
-        self._client = praw.Reddit(client_id=self._cid, client_secret=secret, user_agent=self._agent)
-        self._subreddits = SubredditConfig(reddit_config[YAML_KEY_SUBREDDITS])
-        self._validate_subreddits()
+        self._client = praw.Reddit(client_id=self._cid, client_secret=secret, user_agent=self._agent,
+                                   requestor_class=_TimedRequestor)
+        # Optional when every subreddit is watched through `watchlists`
+        self._subreddits = SubredditConfig(reddit_config.get(YAML_KEY_SUBREDDITS) or {})
+
+        self._seen_size = int(reddit_config.get(YAML_KEY_REDDIT_SEEN_SIZE, 10_000))
+        self._catch_up_limit = int(reddit_config.get(YAML_KEY_REDDIT_CATCH_UP_LIMIT, 1000))
+        self._shard_size = int(reddit_config.get(YAML_KEY_REDDIT_SHARD_SIZE, 25))
+        self._poll_interval = (
+            float(reddit_config.get(YAML_KEY_REDDIT_MIN_POLL_INTERVAL, 5)),
+            float(reddit_config.get(YAML_KEY_REDDIT_MAX_POLL_INTERVAL, 120)),
+        )
+        self._seen_store = SeenStore(os.path.join(_DATA_DIR, _SEEN_STORE_FILE), self._seen_size)
 
     @property
     def client(self) -> praw.Reddit:
         return self._client
+
+    @property
+    def seen_store(self) -> SeenStore:
+        return self._seen_store
+
+    @property
+    def catch_up_limit(self) -> int:
+        return self._catch_up_limit
     
+    @property
+    def shard_size(self) -> int:
+        return self._shard_size
+
+    @property
+    def poll_interval(self) -> tuple[float, float]:
+        """Shortest and longest time between polls of a shard, in seconds."""
+        return self._poll_interval
+
     @property
     def sub_config(self) -> SubredditConfig:
         return self._subreddits
@@ -95,24 +292,66 @@ class RedditConfig:
             Agent: {self._agent}
 
             Client: {self._client}
+            Seen IDs: {len(self._seen_store)} of {self._seen_size}
+            Catch Up Limit: {self._catch_up_limit}
+            Shard Size: {self._shard_size}
+            Poll Interval (min, max): {self._poll_interval}
             
             Subreddits
             {self.sub_config}
         """
     
-    def _validate_subreddits(self):
-        """Validate subreddits."""
-        for sub in self.sub_config.subreddits:
-            try:
-                self._client.subreddit(sub).id
+    def validate_subreddits(self, subreddits: list[str], cache_ttl: float) -> list[str]:
+        """Validate subreddits concurrently, returning the invalid ones.
+
+        Subreddits validated within `cache_ttl` seconds are not fetched again.
+        """
+        cache_path = os.path.join(_DATA_DIR, _SUBREDDIT_CACHE_FILE)
+        validated = _load_subreddit_cache(cache_path, cache_ttl)
+        pending = [sub for sub in subreddits if sub not in validated]
+        logger.info("Validating %d subreddits, %d cached", len(pending), len(validated))
+
+        with ThreadPoolExecutor(max_workers=min(8, len(pending) or 1)) as executor:
+            results = dict(zip(pending, executor.map(self._validate_subreddit, pending)))
+
+        now = time.time()
+        validated.update({sub: now for sub, valid in results.items() if valid})
+        _save_subreddit_cache(cache_path, validated)
+
+        return [sub for sub, valid in results.items() if valid is False]
+
+    def _validate_subreddit(self, sub: str) -> bool | None:
+        """Return whether the subreddit exists, or None if Reddit couldn't tell us."""
+        try:
+            self._client.subreddit(sub).id
+            return True
+
+        except prawcore.exceptions.Redirect:
+            return False
+
+        except (praw.exceptions.PRAWException,
+                prawcore.exceptions.PrawcoreException) as exception:
+            logger.error("Reddit API Error: %s", exception)
+            return None
+
 
-            except prawcore.exceptions.Redirect:
-                sys.exit("Invalid Subreddit: " + sub)
+def _load_subreddit_cache(path: str, ttl: float) -> dict[str, float]:
+    try:
+        with open(path, "r", encoding="utf-8") as cache_file:
+            cached = json.load(cache_file)
+    except (OSError, ValueError):
+        return {}
 
-            except (praw.exceptions.PRAWException,
-                    prawcore.exceptions.PrawcoreException) as exception:
-                print("Reddit API Error: ")
-                print(exception)
+    oldest = time.time() - ttl
+    return {sub: validated for sub, validated in cached.items() if validated >= oldest}
+
+
+def _save_subreddit_cache(path: str, validated: dict[str, float]):
+    try:
+        with open(path, "w", encoding="utf-8") as cache_file:
+            json.dump(validated, cache_file)
+    except OSError as exception:
+        logger.warning("Could not save subreddit cache: %s", exception)
 
 
 class AlertConfig:
@@ -145,24 +384,258 @@ class AlertConfig:
     def __str__(self):
         return f"AlertConfig(notify={self.notify}, filter={self.filter}, error={self.error})"
 
-def load_config() -> tuple[RedditConfig, AIConfig, AlertConfig]:
+class WatchlistConfig:
+    """Subreddit terms and alert targets for one more user, alongside the default watchlist."""
+    def __init__(self, name: str, watchlist_config: dict):
+        self._name = name
+        self._sub_config = SubredditConfig(watchlist_config.get(YAML_KEY_SUBREDDITS) or {})
+        self._alert_config = AlertConfig(watchlist_config.get(YAML_KEY_APPRISE) or {})
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def sub_config(self) -> SubredditConfig:
+        return self._sub_config
+
+    @property
+    def alert_config(self) -> AlertConfig:
+        return self._alert_config
+
+    def __str__(self):
+        return f"""
+            Watchlist {self._name}
+            Alerts: {self._alert_config}
+            {self._sub_config}
+        """
+
+class PipelineConfig:
+    def __init__(self, pipeline_config: dict[str, int]):
+        self._workers = int(pipeline_config.get(YAML_KEY_PIPELINE_WORKERS, 4))
+        self._queue_size = int(pipeline_config.get(YAML_KEY_PIPELINE_QUEUE_SIZE, 100))
+        self._queue_path = pipeline_config.get(YAML_KEY_PIPELINE_QUEUE_PATH, "work_queue.db")
+        self._max_attempts = int(pipeline_config.get(YAML_KEY_PIPELINE_MAX_ATTEMPTS, 10))
+        self._retry_backoff = float(pipeline_config.get(YAML_KEY_PIPELINE_RETRY_BACKOFF, 30))
+
+        if self._workers < 1 or self._queue_size < 1 or self._max_attempts < 1:
+            sys.exit("Invalid config: pipeline workers, queue_size and max_attempts must be at least 1")
+
+        self._work_queue = WorkQueue(
+            path=os.path.join(_DATA_DIR, self._queue_path) if self._queue_path else None,
+            max_pending=self._queue_size,
+            max_attempts=self._max_attempts,
+            backoff=self._retry_backoff,
+        )
+
+    @property
+    def workers(self) -> int:
+        return self._workers
+
+    @property
+    def queue_size(self) -> int:
+        return self._queue_size
+
+    @property
+    def work_queue(self) -> WorkQueue:
+        return self._work_queue
+
+    def __str__(self):
+        return (
+            f"PipelineConfig(workers={self.workers}, queue_size={self.queue_size}, queue_path={self._queue_path!r}, "
+            f"max_attempts={self._max_attempts}, retry_backoff={self._retry_backoff})"
+        )
+
+class StartupConfig:
+    def __init__(self, startup_config: dict, skipped: set[str]):
+        self._checks = {
+            check: bool(startup_config.get(check, True)) and check not in skipped
+            for check in STARTUP_CHECKS
+        }
+        self._subreddit_cache_ttl = float(startup_config.get(YAML_KEY_STARTUP_SUBREDDIT_CACHE_TTL, 24 * 60 * 60))
+
+    @property
+    def validate_subreddits(self) -> bool:
+        return self._checks[STARTUP_CHECK_VALIDATE_SUBREDDITS]
+
+    @property
+    def test_alerts(self) -> bool:
+        return self._checks[STARTUP_CHECK_TEST_ALERTS]
+
+    @property
+    def self_test(self) -> bool:
+        return self._checks[STARTUP_CHECK_SELF_TEST]
+
+    @property
+    def subreddit_cache_ttl(self) -> float:
+        return self._subreddit_cache_ttl
+
+    def __str__(self):
+        return f"StartupConfig(checks={self._checks}, subreddit_cache_ttl={self.subreddit_cache_ttl})"
+
+class MetricsConfig:
+    def __init__(self, metrics_config: dict | None):
+        self._enabled = metrics_config is not None
+        metrics_config = metrics_config or {}
+        self._host = metrics_config.get(YAML_KEY_METRICS_HOST, "127.0.0.1")
+        self._port = int(metrics_config.get(YAML_KEY_METRICS_PORT, 9100))
+
+    @property
+    def enabled(self) -> bool:
+        return self._enabled
+
+    @property
+    def host(self) -> str:
+        return self._host
+
+    @property
+    def port(self) -> int:
+        return self._port
+
+    def __str__(self):
+        if not self.enabled:
+            return "MetricsConfig(disabled)"
+        return f"MetricsConfig(host={self.host}, port={self.port})"
+
+def load_config(skipped_checks: set[str] = frozenset()) -> tuple[RedditConfig, AIConfig, AlertConfig, PipelineConfig, StartupConfig,
+                                                                  MetricsConfig, list[WatchlistConfig]]:
     """Returns application configuration."""
 
-    # Check if config file exists
-    if not os.path.exists(_CONFIG_PATH):
-        sys.exit("Missing config file: " + _CONFIG_PATH)
-    print("Using config file: " + _CONFIG_PATH)
+    logger.info("Using config file: %s", _CONFIG_PATH)
 
     config = _get_config()
     reddit = RedditConfig(config[YAML_KEY_REDDIT])
     ai = AIConfig(config[YAML_KEY_AI])
     alert = AlertConfig(config[YAML_KEY_APPRISE])
+    pipeline = PipelineConfig(config.get(YAML_KEY_PIPELINE) or {})
+    startup = StartupConfig(config.get(YAML_KEY_STARTUP) or {}, skipped_checks)
+    # An empty `metrics:` section turns metrics on with the defaults
+    metrics_config = MetricsConfig(config[YAML_KEY_METRICS] or {} if YAML_KEY_METRICS in config else None)
+    watchlists = _watchlist_configs(config)
+
+    _print_config(reddit, ai, alert, pipeline, startup, metrics_config, watchlists)
+    return reddit, ai, alert, pipeline, startup, metrics_config, watchlists
+
+
+def load_watchlists() -> list[WatchlistConfig]:
+    """Returns every watchlist, the default one first, without connecting to Reddit or the alert services."""
+    return _all_watchlists(_get_config())
+
+
+def load_ai_config() -> AIConfig:
+    """Returns the AI configuration on its own, for processing posts offline."""
+    return AIConfig(_get_config()[YAML_KEY_AI])
+
+
+def _all_watchlists(config: dict) -> list[WatchlistConfig]:
+    # reddit.subreddits and the top level apprise urls make up the default watchlist
+    return [
+        WatchlistConfig(DEFAULT_WATCHLIST, {
+            YAML_KEY_SUBREDDITS: config[YAML_KEY_REDDIT].get(YAML_KEY_SUBREDDITS),
+            YAML_KEY_APPRISE: config[YAML_KEY_APPRISE],
+        }),
+        *_watchlist_configs(config),
+    ]
+
+
+def _watchlist_configs(config: dict) -> list[WatchlistConfig]:
+    watchlists = [WatchlistConfig(str(name), watchlist) for name, watchlist in (config.get(YAML_KEY_WATCHLISTS) or {}).items()]
+    if DEFAULT_WATCHLIST in (watchlist.name for watchlist in watchlists):
+        sys.exit(f"Invalid config: the {DEFAULT_WATCHLIST} watchlist is reddit.subreddits, use another name")
+    return watchlists
+
+
+class ConfigWatcher:
+    """Reload the config file when it changes, or when `reload` is called.
+
+    Subreddits and apprise urls, of the default and the other watchlists,
+    are passed to `on_change` as WatchlistConfigs, the default watchlist
+    first, to apply without a restart. Changes to other settings are logged
+    and need a restart. If the file fails to load or `on_change` raises, the
+    error is logged and passed to `on_error`, and the running config kept.
+    `on_change` raises ValueError to reject a config.
+    """
+    def __init__(self, on_change, on_error=None):
+        self._on_change = on_change
+        self._on_error = on_error
+        self._lock = threading.Lock()
+        self._mtime = _config_mtime()
+        self._config = _get_config()
+
+    def start(self):
+        threading.Thread(target=self._watch, name="config-watcher", daemon=True).start()
+
+    def reload(self):
+        with self._lock:
+            try:
+                config = _get_config()
+                watchlists = _all_watchlists(config)
+            except (SystemExit, Exception) as exception: # pylint: disable=broad-except
+                logger.error("Keeping the running config, failed to reload %s: %s", _CONFIG_PATH, exception)
+                self._error(exception)
+                return
+
+            if config == self._config:
+                return
+            restart = [
+                key for key in sorted(config.keys() | self._config.keys())
+                if key not in (YAML_KEY_APPRISE, YAML_KEY_WATCHLISTS) and _without_subreddits(key, config) != _without_subreddits(key, self._config)
+            ]
+            if restart:
+                logger.warning("Restart to apply changes to: %s", ", ".join(restart))
+
+            logger.info("Reloading watchlists from %s", _CONFIG_PATH)
+            for watchlist in watchlists:
+                logger.debug("Watching for: %s", watchlist)
+            # Not remembering a config that wasn't applied lets the next reload try it again
+            try:
+                self._on_change(watchlists)
+            except ValueError as exception:
+                logger.error("Keeping the running config, %s rejected: %s", _CONFIG_PATH, exception)
+                self._error(exception)
+                return
+            except Exception as exception: # pylint: disable=broad-except
+                logger.exception("Keeping the running config, failed to apply %s", _CONFIG_PATH)
+                self._error(exception)
+                return
+            self._config = config
+
+    def _error(self, exception: BaseException):
+        if self._on_error is not None:
+            self._on_error(f"Config not reloaded: {exception}")
+
+    def _watch(self):
+        while True:
+            time.sleep(_WATCH_INTERVAL)
+            try:
+                mtime = _config_mtime()
+                if mtime is not None and mtime != self._mtime:
+                    self._mtime = mtime
+                    self.reload()
+            except Exception: # pylint: disable=broad-except
+                logger.exception("Config watcher error")
+
+
+def _config_mtime() -> int | None:
+    try:
+        return os.stat(_CONFIG_PATH).st_mtime_ns
+    except OSError:
+        # Editors can briefly remove the file while saving it
+        return None
+
 
-    _print_config(reddit, ai, alert)
-    return reddit, ai, alert
+def _without_subreddits(key: str, config: dict):
+    section = config.get(key)
+    if key == YAML_KEY_REDDIT and isinstance(section, dict):
+        return {name: value for name, value in section.items() if name != YAML_KEY_SUBREDDITS}
+    return section
 
 
 def _get_config():
+    # Check if config file exists
+    if not os.path.exists(_CONFIG_PATH):
+        sys.exit("Missing config file: " + _CONFIG_PATH)
+
     # Load config into memory
     with open(_CONFIG_PATH, "r", encoding="utf-8") as config_yaml:
         config = None
@@ -173,7 +646,7 @@ def _get_config():
         except yaml.YAMLError as exception:
             if hasattr(exception, "problem_mark"):
                 mark = exception.problem_mark # pylint: disable=no-member
-                print(f"Invalid yaml, line {mark.line + 1}, column {mark.column + 1}")
+                logger.error("Invalid yaml, line %d, column %d", mark.line + 1, mark.column + 1)
 
             sys.exit("Invalid config: failed to parse yaml")
 
@@ -183,14 +656,15 @@ def _get_config():
         return config
 
 
-def _print_config(reddit: RedditConfig, ai: AIConfig, alert: AlertConfig):
-    """Print the loaded configuration"""
-
-    print("Monitoring Reddit for:")
-    print(reddit)
-    
-    print("Using AI Model:")
-    print(ai)
+def _print_config(reddit: RedditConfig, ai: AIConfig, alert: AlertConfig, pipeline: PipelineConfig, startup: StartupConfig,
+                  metrics_config: MetricsConfig, watchlists: list[WatchlistConfig]):
+    """Log the loaded configuration"""
 
-    print("Sending Alerts to:")
-    print(alert)
\ No newline at end of file
+    logger.info("Monitoring Reddit for: %s", reddit)
+    logger.info("Using AI Model: %s", ai)
+    logger.info("Sending Alerts to: %s", alert)
+    logger.info("Processing with: %s", pipeline)
+    logger.info("Startup checks: %s", startup)
+    logger.info("Metrics: %s", metrics_config)
+    for watchlist in watchlists:
+        logger.info("Watching for: %s", watchlist)
@@ -0,0 +1,180 @@
+"""Ordered LLM endpoints with circuit breakers, failover and hedged requests."""
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urlsplit
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Recent request times kept per endpoint to decide when to hedge
+_LATENCY_WINDOW = 200
+# Don't hedge until an endpoint has answered this many requests
+_MIN_LATENCY_SAMPLES = 20
+
+
+class EndpointsUnavailable(Exception):
+    """Raised when the circuit of every endpoint is open."""
+
+
+class Endpoint:
+    """One LLM endpoint and model, with a circuit breaker and its recent latencies.
+
+    After `failure_threshold` failed requests in a row the circuit opens and
+    the endpoint is skipped for `cooldown` seconds. Then a single request is
+    let through to probe it, and the circuit closes again if it succeeds.
+    """
+    def __init__(self, url: str, api_key: str, model: str, failure_threshold: int = 3, cooldown: float = 30):
+        self.url = url
+        self.api_key = api_key
+        self.model = model
+        self.name = f"{urlsplit(url).netloc or url} {model}"
+        self._failure_threshold = failure_threshold
+        self._cooldown = cooldown
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._open_until = 0.0
+        self._probing = False
+        self._latencies = deque(maxlen=_LATENCY_WINDOW)
+
+    @property
+    def healthy(self) -> bool:
+        """False while the circuit is open or half open."""
+        return self._failures < self._failure_threshold
+
+    def available(self) -> bool:
+        """Whether a request could be sent now, without claiming the probe of a half open circuit."""
+        with self._lock:
+            return self.healthy or (not self._probing and time.monotonic() >= self._open_until)
+
+    def acquire(self) -> bool:
+        """Claim the endpoint for a request, False if its circuit is open or already being probed."""
+        with self._lock:
+            if self.healthy:
+                return True
+            if self._probing or time.monotonic() < self._open_until:
+                return False
+            logger.info("Probing AI endpoint %s", self.name)
+            self._probing = True
+            return True
+
+    def succeeded(self, seconds: float):
+        with self._lock:
+            if not self.healthy:
+                logger.info("AI endpoint %s recovered", self.name)
+            self._failures = 0
+            self._probing = False
+            self._latencies.append(seconds)
+
+    def failed(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if not self.healthy:
+                self._open_until = time.monotonic() + self._cooldown
+                if self._failures == self._failure_threshold:
+                    logger.warning("AI endpoint %s failed %d times in a row, skipping it for %.0f seconds",
+                                   self.name, self._failures, self._cooldown)
+
+    def latency(self, percentile: float) -> float | None:
+        """The given percentile of recent request times, None until there are enough of them."""
+        with self._lock:
+            if len(self._latencies) < _MIN_LATENCY_SAMPLES:
+                return None
+            ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))]
+
+
+class EndpointPool:
+    """Send each request to the first endpoint whose circuit is closed, falling over to the next ones in order.
+
+    `send(endpoint, last)` makes the request to one endpoint and raises one of
+    `errors` if it fails. `last` is True when no other endpoint is left to
+    fall over to, so retrying there is the only option. With
+    `hedge_percentile` set, a request still running after that percentile of
+    the endpoint's recent request times is also sent to the next endpoint,
+    and whichever answers first is used.
+    """
+    def __init__(self, endpoints: list[Endpoint], errors: tuple[type[Exception], ...], hedge_percentile: float | None = None,
+                 max_workers: int = 10):
+        self._endpoints = endpoints
+        self._errors = errors
+        self._hedge_percentile = hedge_percentile
+        # Hedged requests run here while the caller waits for the first answer
+        self._executor = ThreadPoolExecutor(max_workers * 2, thread_name_prefix="hedge") if hedge_percentile and len(endpoints) > 1 else None
+
+        metrics.AI_ENDPOINT_UP.set_function(
+            lambda: [({"endpoint": endpoint.name}, int(endpoint.healthy)) for endpoint in self._endpoints]
+        )
+
+    @property
+    def endpoints(self) -> list[Endpoint]:
+        return self._endpoints
+
+    def call(self, send):
+        """Return the first successful `send`, raising EndpointsUnavailable once every circuit is open."""
+        error = None
+        remaining = list(self._endpoints)
+        while remaining:
+            endpoint = remaining.pop(0)
+            if not endpoint.acquire():
+                continue
+            if error is not None:
+                logger.warning("Falling over to AI endpoint %s: %s", endpoint.name, error)
+                metrics.AI_FAILOVERS.inc()
+            try:
+                if self._executor is not None:
+                    return self._hedged(endpoint, remaining, send)
+                return self._send(endpoint, send, self._last(remaining))
+            except self._errors as exception: # pylint: disable=catching-non-exception
+                error = exception
+
+        if error is None:
+            raise EndpointsUnavailable("No AI endpoint available, every endpoint is being skipped after errors")
+        if not any(endpoint.available() for endpoint in self._endpoints):
+            raise EndpointsUnavailable(f"No AI endpoint available, last error: {error}") from error
+        raise error
+
+    @staticmethod
+    def _last(remaining: list[Endpoint]) -> bool:
+        return not any(endpoint.available() for endpoint in remaining)
+
+    @staticmethod
+    def _send(endpoint: Endpoint, send, last: bool):
+        started = time.monotonic()
+        try:
+            result = send(endpoint, last)
+        except Exception:
+            endpoint.failed()
+            raise
+        endpoint.succeeded(time.monotonic() - started)
+        return result
+
+    def _hedged(self, endpoint: Endpoint, remaining: list[Endpoint], send):
+        delay = endpoint.latency(self._hedge_percentile)
+        if delay is None or self._last(remaining):
+            return self._send(endpoint, send, self._last(remaining))
+
+        futures = [self._executor.submit(self._send, endpoint, send, False)]
+        done, _ = wait(futures, timeout=delay)
+        if not done:
+            hedge = next((other for other in remaining if other.acquire()), None)
+            if hedge is not None:
+                remaining.remove(hedge)
+                logger.debug("Hedging slow request to %s with %s", endpoint.name, hedge.name)
+                metrics.AI_HEDGED_REQUESTS.inc()
+                futures.append(self._executor.submit(self._send, hedge, send, self._last(remaining)))
+
+        # The slower request is left to finish in the background, its answer is only used for the endpoint's health
+        error = None
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                futures.remove(future)
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+        raise error
@@ -0,0 +1,102 @@
+"""Rule-based alert titles for sale posts with item tables or inline prices."""
+import re
+
+from lib import STRUCK_THROUGH, TABLE_SEPARATOR, clean_markdown
+
+_PRICE = re.compile(r"[$£€]\s?\d[\d,]*(?:\.\d{2})?")
+_LOCAL_ONLY = re.compile(r"local (?:sales |pickup |pick up )?only|will not ship|won't ship|no shipping", re.IGNORECASE)
+# Extra detail after the item name, like "RTX 5080 FE - will not ship"
+_ITEM_DETAIL = re.compile(r"\s+[-–]\s+.*$")
+_SEGMENT_SEPARATORS = re.compile(r"[;\n]|,\s(?=\D)")
+# List entries like "* RTX 5080 FE - $1200", prose like "selling my 5080 for $1200" is left to the AI
+_INLINE_ITEM = re.compile(r"^[-*+•\s]*(.+?)\s*[-–:=@]\s*$")
+_SOLD = re.compile(r"\bsold\b", re.IGNORECASE)
+
+_ITEM_HEADERS = ("item", "product", "name", "description", "part")
+_PRICE_HEADERS = ("price", "asking", "cost")
+# Longer item names are more likely a sentence than an item
+_MAX_ITEM_LENGTH = 60
+
+
+def sale_title(body: str, matched_terms: list[str]) -> str | None:
+    """Build an "Item - $price" title from the rows and lines that mention the matched terms.
+
+    Returns None unless every matched term that appears in the body has an item
+    with a price, so the caller can fall back to the AI.
+    """
+    # Struck through text is sold items or old prices, leaving the live ones
+    lines = [STRUCK_THROUGH.sub("", line) for line in clean_markdown(body)]
+    terms = [term.lower() for term in matched_terms]
+
+    items = _table_items(lines, terms) + _inline_items(lines, terms)
+    found = {term for term in terms if any(term in line.lower() for line in lines)}
+    if not found or any(not any(term in item.lower() for item, _ in items) for term in found):
+        return None
+
+    seen = set()
+    parts = []
+    for item, price in items:
+        if item.lower() not in seen:
+            seen.add(item.lower())
+            parts.append(f"{item} - {price}")
+    return ", ".join(parts)
+
+
+def _cells(line: str) -> list[str]:
+    return [cell.strip() for cell in line.strip().strip("|").split("|")]
+
+
+def _table_items(lines: list[str], terms: list[str]) -> list[tuple[str, str]]:
+    """Items from markdown table rows that mention a term, using the header to find the item and price columns."""
+    items = []
+    header = None
+    for index, line in enumerate(lines):
+        if "|" not in line:
+            header = None
+            continue
+        if TABLE_SEPARATOR.match(line):
+            continue
+        if header is None:
+            # A table starts with a header row followed by a separator row
+            if index + 1 < len(lines) and TABLE_SEPARATOR.match(lines[index + 1]):
+                header = [cell.lower() for cell in _cells(line)]
+            continue
+
+        cells = _cells(line)
+        if not any(term in line.lower() for term in terms) or _SOLD.search(line):
+            continue
+        item = _cell(cells, header, _ITEM_HEADERS, default=0)
+        price = _PRICE.search(_cell(cells, header, _PRICE_HEADERS) or line)
+        if item and price:
+            items.append(_item(item, price.group(), line))
+    return items
+
+
+def _cell(cells: list[str], header: list[str], names: tuple[str, ...], default: int | None = None) -> str | None:
+    for index, column in enumerate(header):
+        if any(name in column for name in names) and index < len(cells):
+            return cells[index]
+    return cells[default] if default is not None and default < len(cells) else None
+
+
+def _inline_items(lines: list[str], terms: list[str]) -> list[tuple[str, str]]:
+    """Items from list lines like "RTX 5080 FE - $1200 shipped" with one price next to a term."""
+    items = []
+    for line in lines:
+        if "|" in line:
+            continue
+        for segment in _SEGMENT_SEPARATORS.split(line):
+            prices = _PRICE.findall(segment)
+            if len(prices) != 1 or not any(term in segment.lower() for term in terms) or _SOLD.search(segment):
+                continue
+            entry = _INLINE_ITEM.match(segment.split(prices[0])[0])
+            if entry and any(term in entry.group(1).lower() for term in terms) and len(entry.group(1)) <= _MAX_ITEM_LENGTH:
+                items.append(_item(entry.group(1), prices[0], segment))
+    return items
+
+
+def _item(name: str, price: str, context: str) -> tuple[str, str]:
+    name = _ITEM_DETAIL.sub("", name).strip()
+    if _LOCAL_ONLY.search(context):
+        name += " (Local Only)"
+    return name, price.replace(" ", "")
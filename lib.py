@@ -1,6 +1,46 @@
+import html
+import re
 from enum import StrEnum
 
 class AlertLevel(StrEnum):
     NOTIFY = 'notify'
     FILTER = 'filter'
-    ERROR = 'error'
\ No newline at end of file
+    ERROR = 'error'
+
+class Submission:
+    """Post read from somewhere other than PRAW, shaped like a PRAW submission."""
+    def __init__(self, submission_id: str, title: str, selftext: str, subreddit: str, permalink: str):
+        self.id = submission_id
+        self.title = title
+        self.selftext = selftext
+        self.permalink = permalink
+        self.subreddit = self.Subreddit(subreddit)
+
+    class Subreddit:
+        def __init__(self, display_name):
+            self.display_name = display_name
+
+    @classmethod
+    def from_record(cls, record: dict) -> "Submission":
+        """From a dict with id, title, selftext, subreddit and permalink, like a line of a dump."""
+        return cls(record["id"], record["title"], record["selftext"], record["subreddit"], record["permalink"])
+
+_MARKDOWN_LINK = re.compile(r"\[([^\]]*)\]\([^)]*\)")
+_URL = re.compile(r"https?://\S+")
+_MARKDOWN_EMPHASIS = re.compile(r"(\*\*|__|`|^#+\s*|^>\s*)", re.MULTILINE)
+TABLE_SEPARATOR = re.compile(r"^\|?\s*:?-+:?\s*(\|\s*:?-+:?\s*)*\|?$")
+# Sellers strike through items that are sold or prices they have lowered
+STRUCK_THROUGH = re.compile(r"~~.*?~~")
+
+def clean_markdown(body: str) -> list[str]:
+    """Split a post body into lines of plain text, without links, URLs, emphasis or blank lines.
+
+    Table rows, including their separator rows, are kept as they are. So is
+    ~~strikethrough~~, which marks sold items, see `STRUCK_THROUGH`.
+    """
+    # Reddit double-escapes entities, e.g. &amp;nbsp;
+    text = html.unescape(html.unescape(body)).replace("\xa0", " ")
+    text = _URL.sub("", _MARKDOWN_LINK.sub(r"\1", text))
+    text = _MARKDOWN_EMPHASIS.sub("", text)
+    lines = [" ".join(line.split()) for line in text.splitlines()]
+    return [line for line in lines if line]
@@ -0,0 +1,47 @@
+"""Keyword matching for Reddit posts."""
+import re
+
+
+class TermMatcher:
+    """Precompiled matcher for a list of terms.
+
+    All terms are folded into one regex so each text is lowercased once and
+    scanned in a single pass, no matter how many terms are configured.
+    """
+    def __init__(self, terms: list[str]):
+        self._terms = list(terms)
+
+        # Lowercased term -> configured spellings, so hits report the original terms
+        self._lookup: dict[str, list[str]] = {}
+        for term in self._terms:
+            self._lookup.setdefault(term.lower(), []).append(term)
+
+        self._pattern = _compile(self._lookup.keys())
+
+        # A hit on a longer term implies a hit on every term it contains
+        self._implied = {
+            term: [other for other in self._lookup if other in term]
+            for term in self._lookup
+        }
+
+    @property
+    def terms(self) -> list[str]:
+        return self._terms
+
+    def find(self, text: str) -> list[str]:
+        """Return the terms found in `text`."""
+        if not self._pattern:
+            return []
+        hits = set()
+        for found in self._pattern.findall(text.lower()):
+            hits.update(self._implied[found])
+        return [term for key in self._lookup if key in hits for term in self._lookup[key]]
+
+
+def _compile(terms) -> re.Pattern | None:
+    """Combine terms into one overlapping, longest-first alternation."""
+    terms = sorted(set(terms), key=len, reverse=True)
+    if not terms:
+        return None
+    # The lookahead lets overlapping terms that start at different offsets all be found
+    return re.compile("(?=(" + "|".join(re.escape(term) for term in terms) + "))")
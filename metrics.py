@@ -0,0 +1,195 @@
+"""Process metrics in the Prometheus text format.
+
+Metrics are module-level and updated directly by the stages they measure. `serve`
+exposes them over HTTP for scraping.
+"""
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+_DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_registry = []
+
+
+def _label_key(labels: dict[str, str]) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key: tuple, extra: dict[str, str] | None = None) -> str:
+    labels = dict(key, **(extra or {}))
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels.items()) + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}", *self._samples()]
+
+    def _samples(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, description: str):
+        super().__init__(name, description)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(_label_key(labels), 0)
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            return [f"{self.name}{_format_labels(key)} {value}" for key, value in self._values.items()]
+
+
+class Gauge(_Metric):
+    """Gauge that is either set directly or read from `function` at scrape time."""
+    kind = "gauge"
+
+    def __init__(self, name: str, description: str, function=None):
+        super().__init__(name, description)
+        self._values: dict[tuple, float] = {}
+        self._function = function
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+    def set_function(self, function):
+        """Read the gauge from `function`, which returns a value or a list of (labels, value) pairs."""
+        self._function = function
+
+    def _samples(self) -> list[str]:
+        if self._function is None:
+            with self._lock:
+                values = dict(self._values)
+        else:
+            try:
+                result = self._function()
+            except Exception as exception: # pylint: disable=broad-except
+                logger.warning("Could not read gauge %s: %s", self.name, exception)
+                return []
+            if isinstance(result, list):
+                values = {_label_key(labels): value for labels, value in result}
+            else:
+                values = {(): result}
+        return [f"{self.name}{_format_labels(key)} {value}" for key, value in values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, buckets: tuple[float, ...] = _DEFAULT_BUCKETS):
+        super().__init__(name, description)
+        self._buckets = buckets
+        # Label key -> (per-bucket counts, sum, count)
+        self._values: dict[tuple, tuple[list[int], float, int]] = {}
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(key) or ([0] * len(self._buckets), 0, 0)
+            index = bisect.bisect_left(self._buckets, value)
+            if index < len(counts):
+                counts[index] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self) -> list[str]:
+        samples = []
+        with self._lock:
+            for key, (counts, total, count) in self._values.items():
+                cumulative = 0
+                for bucket, bucket_count in zip(self._buckets, counts):
+                    cumulative += bucket_count
+                    samples.append(f"{self.name}_bucket{_format_labels(key, {'le': bucket})} {cumulative}")
+                samples.append(f"{self.name}_bucket{_format_labels(key, {'le': '+Inf'})} {count}")
+                samples.append(f"{self.name}_sum{_format_labels(key)} {total}")
+                samples.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return samples
+
+
+REDDIT_REQUEST_SECONDS = Histogram("rpn_reddit_request_seconds", "Time spent on Reddit API requests.")
+MATCH_SECONDS = Histogram("rpn_match_seconds", "Time spent keyword matching a post.",
+                          buckets=(0.00001, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05))
+LLM_REQUEST_SECONDS = Histogram("rpn_llm_request_seconds", "Time spent on LLM requests, including retries, by request kind.")
+AI_BATCH_SIZE = Histogram("rpn_ai_batch_size", "Posts sent in each batched AI request, by request kind.", buckets=(2, 4, 8, 16, 32))
+ALERT_DELIVERY_SECONDS = Histogram("rpn_alert_delivery_seconds", "Time spent delivering an alert, by service.")
+
+POSTS_SEEN = Counter("rpn_posts_seen_total", "Posts read from Reddit.")
+POSTS_MATCHED = Counter("rpn_posts_matched_total", "Posts matching the keyword filter.")
+POSTS_AI_FILTERED = Counter("rpn_posts_ai_filtered_total", "Matching posts the AI rejected.")
+TITLES_EXTRACTED = Counter("rpn_titles_extracted_total", "Alert titles built from a post's item table or price list without the AI.")
+POSTS_WANT_ONLY = Counter("rpn_posts_want_only_total", "Matching trade posts that only want the include terms, by action.")
+POSTS_NOTIFIED = Counter("rpn_posts_notified_total", "Notifications sent for posts, by alert level.")
+ERRORS = Counter("rpn_errors_total", "Errors by stage.")
+AI_FAILOVERS = Counter("rpn_ai_failovers_total", "AI requests sent to a fallback endpoint after an error.")
+AI_HEDGED_REQUESTS = Counter("rpn_ai_hedged_requests_total", "Slow AI requests also sent to the next endpoint.")
+POSTS_DEGRADED = Counter("rpn_posts_degraded_total", "Matching posts notified without the AI while every AI endpoint was failing, by alert level.")
+AI_CACHE_REQUESTS = Counter("rpn_ai_cache_requests_total", "AI cache lookups by result.")
+
+QUEUE_DEPTH = Gauge("rpn_queue_depth", "Jobs in the work queue by state.")
+AI_ENDPOINT_UP = Gauge("rpn_ai_endpoint_up", "1 while an AI endpoint's circuit is closed, 0 while it is skipped after errors.")
+ALERT_QUEUE_DEPTH = Gauge("rpn_alert_queue_depth", "Alerts waiting for delivery, by watchlist, service and level.")
+POLL_INTERVAL = Gauge("rpn_poll_interval_seconds", "Seconds between polls of each subreddit shard, by its first subreddit.")
+REDDIT_RATE_LIMIT_REMAINING = Gauge("rpn_reddit_rate_limit_remaining", "Reddit API requests left in the current rate limit window.")
+LAST_POST_TIMESTAMP = Gauge("rpn_last_post_timestamp_seconds", "Unix time the last post was read from Reddit.")
+
+
+def render() -> str:
+    return "\n".join(line for metric in _registry for line in metric.render()) + "\n"
+
+
+def serve(host: str, port: int) -> ThreadingHTTPServer:
+    """Serve the metrics at /metrics from a background thread."""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+
+            payload = render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info("Serving metrics on http://%s:%s/metrics", host, port)
+    return server
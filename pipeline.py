@@ -0,0 +1,95 @@
+"""Concurrent processing pipeline for matched Reddit submissions."""
+import logging
+import threading
+
+import metrics
+from workqueue import Job, WorkQueue
+
+logger = logging.getLogger(__name__)
+
+
+class Pipeline:
+    """Durable work queue -> pool of AI workers -> alert delivery.
+
+    The stream producer calls `submit`, which blocks once the queue is full so
+    a backlog of slow LLM calls pushes back on the stream instead of growing
+    without bound. `deliver` only hands alerts to the alert client's own
+    delivery queues, so workers move straight on to the next post.
+
+    Jobs that fail are retried with backoff by the work queue, and handed to
+    `on_dead` once they run out of attempts.
+    """
+    def __init__(self, work_queue: WorkQueue, evaluate, deliver, on_error, on_dead, workers: int):
+        self._queue = work_queue
+        self._evaluate = evaluate
+        self._deliver = deliver
+        self._on_error = on_error
+        self._on_dead = on_dead
+
+        metrics.QUEUE_DEPTH.set_function(
+            lambda: [({"state": state}, count) for state, count in self._queue.counts().items()]
+        )
+
+        self._stopping = threading.Event()
+        self._workers = [
+            threading.Thread(target=self._work, name=f"ai-worker-{i}", daemon=True)
+            for i in range(workers)
+        ]
+
+    def start(self):
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, job_id: str, payload: dict) -> bool:
+        """Queue a job for the AI workers, blocking while the queue is full.
+
+        Returns False if the job was already queued or processed.
+        """
+        return self._queue.put(job_id, payload)
+
+    def shutdown(self):
+        """Wait for in-flight jobs, queued jobs are resumed on the next start."""
+        self._stopping.set()
+        self._queue.close()
+        for worker in self._workers:
+            worker.join()
+
+    def _work(self):
+        while not self._stopping.is_set():
+            job = self._queue.get(timeout=1)
+            if job is None:
+                continue
+
+            try:
+                result = self._evaluate(job.payload)
+            except Exception as exception: # pylint: disable=broad-except
+                self._fail(job, exception)
+                continue
+
+            try:
+                if result is not None:
+                    self._deliver(result)
+            except Exception as exception: # pylint: disable=broad-except
+                # Retrying could send duplicate alerts, so delivery errors are only reported
+                self._report(exception)
+            self._queue.done(job)
+
+    def _fail(self, job: Job, exception: Exception):
+        logger.warning("Job %s failed on attempt %d: %s", job.id, job.attempts + 1, exception)
+        metrics.ERRORS.inc(stage="pipeline")
+        if self._queue.retry(job, str(exception)):
+            return
+
+        logger.error("Job %s moved to dead letter", job.id)
+        try:
+            self._on_dead(job.payload, exception)
+        except Exception as dead_exception: # pylint: disable=broad-except
+            self._report(dead_exception)
+
+    def _report(self, exception: Exception):
+        logger.error("Pipeline error: %s", exception)
+        metrics.ERRORS.inc(stage="pipeline")
+        try:
+            self._on_error(exception)
+        except Exception as error_exception: # pylint: disable=broad-except
+            logger.error("Failed to report pipeline error: %s", error_exception)
@@ -0,0 +1,292 @@
+"""Sharded polling of subreddits, paced by post rate and the Reddit rate limit."""
+import logging
+import random
+import threading
+import time
+
+import praw
+import prawcore
+
+import metrics
+from seen import SeenStore
+
+logger = logging.getLogger(__name__)
+
+# Share of the remaining rate limit polling may use, the rest is left for other requests
+_RATE_LIMIT_SHARE = 0.8
+# Reddit allows 100 requests a minute for OAuth clients, used until PRAW has seen the headers
+_DEFAULT_REQUESTS_PER_SECOND = 100 / 60
+# Aim for this many new posts per poll, so busy shards are polled often and quiet ones rarely
+_TARGET_POSTS_PER_POLL = 2
+# Weight of the latest poll in each subreddit's post rate
+_RATE_SMOOTHING = 0.3
+_RESHARD_INTERVAL = 30 * 60
+_ERROR_BACKOFF = 30
+_MAX_ERROR_BACKOFF = 15 * 60
+# One listing request, unless catching up after a restart
+_POLL_LIMIT = 100
+# Stop reading a listing once each of the shard's subreddits has had this many seen posts in a row. Counting
+# per subreddit keeps a quiet subreddit's missed post from hiding behind a busy one's seen posts.
+_SEEN_RUN = 10
+# Long multireddit URLs get rejected
+_MAX_SHARD_NAME = 1500
+
+
+class Shard:
+    """Subreddits fetched together as one multireddit listing."""
+    def __init__(self, subreddits: list[str], prime: bool = False):
+        self.subreddits = subreddits
+        self.name = "+".join(subreddits)
+        self.interval = 0.0
+        self.next_poll = 0.0
+        self.caught_up = False
+        # Only mark the first poll's posts seen, for subreddits added while running
+        self.prime = prime
+        self.failures = 0
+
+
+class PollScheduler:
+    """Poll subreddits in shards, each as often as its subreddits get posts.
+
+    Subreddits are sorted by their observed post rate and grouped into
+    shards, so busy subreddits share quickly polled shards and quiet ones
+    share slow ones. Intervals aim for a couple of new posts per poll within
+    `min_interval` and `max_interval`, and are stretched when the total would
+    use more requests than the Reddit rate limit has left. A failing shard
+    backs off on its own while the others keep polling.
+
+    The first poll of each shard catches up on up to `catch_up_limit` posts
+    made while the app was stopped. On the very first run, with an empty seen
+    store, the current posts are only marked seen, as they are for
+    subreddits added later with `update_subreddits`.
+    """
+    def __init__(self, reddit: praw.Reddit, subreddits: list[str], seen: SeenStore, catch_up_limit: int,
+                 shard_size: int, min_interval: float, max_interval: float, on_error):
+        self._reddit = reddit
+        self._seen = seen
+        self._catch_up_limit = catch_up_limit
+        self._shard_size = shard_size
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self._on_error = on_error
+        self._prime = not len(seen)
+        self._lock = threading.Lock()
+
+        # Posts per second, None until a subreddit has been polled twice
+        self._rates: dict[str, float | None] = dict.fromkeys(subreddits)
+        self._last_polled: dict[str, float] = {}
+        self._shards = self._build_shards()
+        self._resharded = time.monotonic()
+        # Subreddits to switch to, set from another thread and applied by `run`
+        self._pending: list[str] | None = None
+        self._wake = threading.Event()
+
+        metrics.POLL_INTERVAL.set_function(
+            lambda: [({"shard": shard.subreddits[0]}, shard.interval) for shard in self._shards]
+        )
+        metrics.REDDIT_RATE_LIMIT_REMAINING.set_function(
+            lambda: [] if self._limits()[0] is None else self._limits()[0]
+        )
+
+    @property
+    def shards(self) -> list[Shard]:
+        return self._shards
+
+    def run(self, handle, on_first_poll=None):
+        """Poll forever, passing each new submission to `handle`, oldest first.
+
+        `on_first_poll` is called once the first Reddit request has returned.
+        """
+        while True:
+            self._apply_pending()
+            shard = min(self._shards, key=lambda shard: shard.next_poll, default=None)
+            if shard is None:
+                # Every subreddit was removed, wait for some to be added
+                self._wake.wait()
+                continue
+            delay = shard.next_poll - time.monotonic()
+            if delay > 0 and self._wake.wait(delay):
+                # Woken early when the subreddits change
+                continue
+
+            submissions = self.poll(shard)
+            if on_first_poll is not None:
+                on_first_poll()
+                on_first_poll = None
+            for submission in submissions:
+                handle(submission)
+
+            if time.monotonic() - self._resharded > _RESHARD_INTERVAL:
+                self._shards = self._build_shards()
+                self._resharded = time.monotonic()
+                self._schedule(self._resharded)
+
+    def update_subreddits(self, subreddits: list[str]):
+        """Switch to a changed list of subreddits, from any thread.
+
+        Shards keep polling on their own schedule unless one of their
+        subreddits was removed, and added subreddits get shards of their own.
+        """
+        with self._lock:
+            self._pending = list(subreddits)
+        self._wake.set()
+
+    def _apply_pending(self):
+        with self._lock:
+            subreddits, self._pending = self._pending, None
+            self._wake.clear()
+        if subreddits is None:
+            return
+
+        removed = set(self._rates) - set(subreddits)
+        added = [sub for sub in subreddits if sub not in self._rates]
+        for sub in removed:
+            del self._rates[sub]
+            self._last_polled.pop(sub, None)
+        self._rates.update(dict.fromkeys(added))
+
+        shards = []
+        for shard in self._shards:
+            kept = [sub for sub in shard.subreddits if sub not in removed]
+            if kept == shard.subreddits:
+                shards.append(shard)
+            elif kept:
+                # Same subreddits minus the removed ones, so there's nothing new to catch up on
+                smaller = Shard(kept)
+                smaller.caught_up, smaller.prime, smaller.failures, smaller.next_poll = \
+                    shard.caught_up, shard.prime, shard.failures, shard.next_poll
+                shards.append(smaller)
+        shards.extend(Shard(group, prime=True) for group in self._group(added))
+        self._shards = shards
+        logger.info("Subreddits changed: %d added, %d removed, polling %d subreddits in %d shards",
+                    len(added), len(removed), len(self._rates), len(shards))
+        self._schedule(time.monotonic())
+
+    def poll(self, shard: Shard) -> list:
+        """Fetch the shard's unseen posts, oldest first, and schedule its next poll."""
+        limit = _POLL_LIMIT if shard.caught_up else max(self._catch_up_limit, _POLL_LIMIT)
+        try:
+            posts = self._fetch(shard, limit)
+        except (praw.exceptions.PRAWException,
+                prawcore.exceptions.PrawcoreException) as exception:
+            self._fail(shard, exception)
+            return []
+
+        shard.failures = 0
+        now = time.monotonic()
+        if not shard.caught_up:
+            shard.caught_up = True
+            if self._prime or shard.prime:
+                # Nothing to catch up to on the first run, start from the current posts
+                for submission in posts:
+                    self._seen.add(submission.id)
+                posts = []
+            elif posts:
+                logger.info("Catching up on %d posts in %s", len(posts), shard.name)
+        else:
+            self._observe(shard, posts, now)
+
+        for sub in shard.subreddits:
+            self._last_polled[sub] = now
+        self._schedule(now)
+        return posts
+
+    def _fetch(self, shard: Shard, limit: int) -> list:
+        missed = []
+        seen_runs = dict.fromkeys(shard.subreddits, 0)
+        for submission in self._reddit.subreddit(shard.name).new(limit=limit):
+            sub = submission.subreddit.display_name.lower()
+            if submission.id in self._seen:
+                seen_runs[sub] = seen_runs.get(sub, 0) + 1
+                if all(run >= _SEEN_RUN for run in seen_runs.values()):
+                    break
+                continue
+            seen_runs[sub] = 0
+            missed.append(submission)
+        return list(reversed(missed))
+
+    def _fail(self, shard: Shard, exception: Exception):
+        shard.failures += 1
+        delay = min(_MAX_ERROR_BACKOFF, _ERROR_BACKOFF * 2 ** (shard.failures - 1))
+        delay = random.uniform(delay / 2, delay)
+        shard.next_poll = time.monotonic() + delay
+        logger.error("Reddit API Error polling %s, retrying in %.0f seconds: %s", shard.name, delay, exception)
+        metrics.ERRORS.inc(stage="reddit")
+        # One alert per outage, not one per retry
+        if shard.failures == 1:
+            self._on_error(exception)
+
+    def _observe(self, shard: Shard, posts: list, now: float):
+        """Update the post rate of each subreddit in the shard from this poll."""
+        counts = dict.fromkeys(shard.subreddits, 0)
+        for submission in posts:
+            sub = submission.subreddit.display_name.lower()
+            if sub in counts:
+                counts[sub] += 1
+
+        for sub, count in counts.items():
+            elapsed = now - self._last_polled.get(sub, now)
+            if elapsed <= 0:
+                continue
+            rate = count / elapsed
+            previous = self._rates.get(sub)
+            self._rates[sub] = rate if previous is None else previous + _RATE_SMOOTHING * (rate - previous)
+
+    def _schedule(self, now: float):
+        """Set every shard's interval from its post rate, stretched to fit the rate limit."""
+        intervals = []
+        for shard in self._shards:
+            rates = [self._rates.get(sub) for sub in shard.subreddits]
+            if None in rates:
+                # Learn the rate of new subreddits quickly
+                intervals.append(self._min_interval)
+            elif sum(rates):
+                intervals.append(min(self._max_interval, max(self._min_interval, _TARGET_POSTS_PER_POLL / sum(rates))))
+            else:
+                intervals.append(self._max_interval)
+
+        remaining, seconds_left = self._limits()
+        budget = _RATE_LIMIT_SHARE * (remaining / seconds_left if remaining is not None else _DEFAULT_REQUESTS_PER_SECOND)
+        demand = sum(1 / interval for interval in intervals if interval > 0)
+        stretch = demand / budget if budget > 0 and demand > budget else 1
+
+        for shard, interval in zip(self._shards, intervals):
+            shard.interval = interval * stretch
+            if shard.failures:
+                # Backing off after an error
+                continue
+            polled = [self._last_polled.get(sub) for sub in shard.subreddits]
+            shard.next_poll = now if None in polled else max(now, min(polled) + shard.interval)
+
+    def _limits(self) -> tuple[float | None, float]:
+        """Requests left in the current rate limit window and the seconds until it resets."""
+        limits = self._reddit.auth.limits
+        remaining = limits.get("remaining")
+        reset = limits.get("reset_timestamp")
+        if remaining is None or reset is None:
+            return None, 0
+        return remaining, max(1.0, reset - time.time())
+
+    def _build_shards(self) -> list[Shard]:
+        """Group subreddits into shards, busiest first, keeping each shard's URL short."""
+        # Subreddits without a rate yet sort first, so they get polled and measured soon
+        subs = sorted(self._rates, key=lambda sub: -1 if self._rates[sub] is None else -self._rates[sub])
+        previous = {sub: shard for shard in getattr(self, "_shards", []) for sub in shard.subreddits}
+        shards = []
+        for group in self._group(subs):
+            shard = Shard(group)
+            # Keep catching up state, so regrouping doesn't replay the catch up
+            shard.caught_up = all(sub in previous and previous[sub].caught_up for sub in group)
+            shards.append(shard)
+        if len(shards) > 1:
+            logger.info("Polling %d subreddits in %d shards", len(subs), len(shards))
+        return shards
+
+    def _group(self, subs: list[str]) -> list[list[str]]:
+        """Split subreddits into shards of up to `shard_size`, keeping each shard's URL short."""
+        groups = []
+        for sub in subs:
+            if not groups or len(groups[-1]) >= self._shard_size or len("+".join(groups[-1] + [sub])) > _MAX_SHARD_NAME:
+                groups.append([])
+            groups[-1].append(sub)
+        return groups
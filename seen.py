@@ -0,0 +1,64 @@
+"""Persistent record of recently seen submission IDs."""
+import sqlite3
+import threading
+import time
+from collections import deque
+
+# How many additions between trims of the on-disk table
+_TRIM_INTERVAL = 500
+
+
+class SeenStore:
+    """Rolling window of the most recent submission IDs, kept in memory and SQLite.
+
+    Only the newest `max_ids` IDs are remembered, which bounds memory while
+    easily covering the listings Reddit can page back through.
+    """
+    def __init__(self, path: str | None, max_ids: int):
+        self._max_ids = max_ids
+        self._lock = threading.Lock()
+        self._additions = 0
+
+        self._db = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS seen (id TEXT PRIMARY KEY, seen REAL NOT NULL)")
+        self._db.commit()
+
+        rows = self._db.execute("SELECT id FROM seen ORDER BY seen DESC LIMIT ?", (max_ids,)).fetchall()
+        self._order = deque(row[0] for row in reversed(rows))
+        self._ids = set(self._order)
+        self._trim()
+
+    def __contains__(self, submission_id: str) -> bool:
+        with self._lock:
+            return submission_id in self._ids
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._ids)
+
+    def add(self, submission_id: str) -> bool:
+        """Remember an ID, returning False if it was already seen."""
+        with self._lock:
+            if submission_id in self._ids:
+                return False
+
+            self._ids.add(submission_id)
+            self._order.append(submission_id)
+            while len(self._order) > self._max_ids:
+                self._ids.discard(self._order.popleft())
+
+            self._db.execute("INSERT OR REPLACE INTO seen (id, seen) VALUES (?, ?)", (submission_id, time.time()))
+            self._db.commit()
+
+            self._additions += 1
+            if self._additions % _TRIM_INTERVAL == 0:
+                self._trim()
+            return True
+
+    def _trim(self):
+        self._db.execute(
+            "DELETE FROM seen WHERE id NOT IN (SELECT id FROM seen ORDER BY seen DESC LIMIT ?)",
+            (self._max_ids,),
+        )
+        self._db.commit()
@@ -1,11 +1,46 @@
 """Test module for reddit post processing."""
-from app import process_submission
+import io
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import prawcore
+import yaml
+
+import ai
+import alert
+import backfill
+from batching import MicroBatcher
+from cache import ResponseCache
+import extract
+from app import Notification, evaluate_submission, process_submission, reload_watchlists
+import config
+from config import DEFAULT_WATCHLIST
+from lib import AlertLevel, Submission
+from matcher import TermMatcher
+import metrics
+from scheduler import PollScheduler
+from seen import SeenStore
+import trade
+from watchlist import Watchlist, WatchlistIndex
+from workqueue import WorkQueue
+
+logger = logging.getLogger(__name__)
 
 class DummySubConfig:
     """Mock subreddit configuration for testing."""
-    def __init__(self, include, exclude):
+    def __init__(self, include, exclude, subreddit="testsub"):
         self._include = include
         self._exclude = exclude
+        self._subreddit = subreddit
+        self._matcher = TermMatcher(include)
+
+    @property
+    def subreddits(self):
+        return [self._subreddit]
         
     def include_terms(self, sub):
         return self._include
@@ -13,32 +48,554 @@ class DummySubConfig:
     def exclude_terms(self, sub):
         return self._exclude
 
-class DummySubmission:
-    """Mock Reddit submission object for testing."""
-    def __init__(self, title, body, sub_name, permalink):
-        self.title = title
-        self.selftext = body
-        self.subreddit = self.DummySubreddit(sub_name)
-        self.permalink = permalink
-        
-    class DummySubreddit:
-        """Mock subreddit object."""
-        def __init__(self, display_name):
-            self.display_name = display_name
+    def want_only(self, sub):
+        return None
+
+    def matcher(self, sub):
+        return self._matcher
 
 def run_tests(alert_client, ai_client):
     """Run test cases using dummy objects."""
-    print("\n=== Running notification test ===")
+    logger.info("=== Running notification test ===")
     title = "[USA-DC] [H] NVIDIA RTX 3090 Ti Founders Edition (FE) [W] Local Cash or 5090"
     body = "I am selling one NVIDIA GeForce 3090 Ti Founders Edition (FE) GPU. Original owner. Used for AI/ML side projects here and there.\n\nAsking for $1,200 shipped to CONUS, $1150 local, or a 5090.\n\n[Timestamp Video](https://imgur.com/a/o3OXWUi)\n\n*Replacing an earlier post with a mistake in the title.*"
     
     # Create test submission and config
-    test_submission = DummySubmission(title, body, "testsub", "/r/testsub/permalink")
+    test_submission = Submission("test", title, body, "testsub", "/r/testsub/permalink")
     test_config = DummySubConfig(include=["3090"], exclude=[])
     
     # Process as real submission
-    process_submission(test_submission, test_config, alert_client, ai_client)
+    process_submission(test_submission, _single_watchlist(test_config, alert_client), alert_client, ai_client)
     
-    print("\n=== Running filter test ===")
+    logger.info("=== Running filter test ===")
     test_config = DummySubConfig(include=["5090"], exclude=[])
-    process_submission(test_submission, test_config, alert_client, ai_client)
\ No newline at end of file
+    process_submission(test_submission, _single_watchlist(test_config, alert_client), alert_client, ai_client)
+
+def _single_watchlist(sub_config, alert_client):
+    return WatchlistIndex([Watchlist(DEFAULT_WATCHLIST, sub_config, alert_client)])
+
+class StubAIServer:
+    """Local OpenAI-compatible endpoint that replays scripted responses."""
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = []
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers["Content-Length"]))
+                stub.requests.append(self.client_address)
+
+                status, headers, content, delay = stub.responses.pop(0)
+                time.sleep(delay)
+                if status == 200:
+                    payload = json.dumps({"choices": [{"message": {"content": content}}]}).encode()
+                else:
+                    payload = content.encode()
+
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def _stub_client(url, **kwargs):
+    return ai.Client(url=url, api_key="test", model="test", backoff=0.01, **kwargs)
+
+
+def test_ai_client_retries_and_reuses_connection():
+    responses = [
+        (503, {"Retry-After": "0"}, "overloaded", 0),
+        (429, {}, "slow down", 0),
+        (200, {}, "<thinking>hmm</thinking>True", 0),
+    ]
+    with StubAIServer(responses) as stub:
+        assert _stub_client(stub.url).check_post_valid("title", "body", ["term"])
+
+    assert len(stub.requests) == 3
+    assert len(set(stub.requests)) == 1, "requests should share one keep-alive connection"
+
+
+def test_ai_client_raises_typed_errors():
+    with StubAIServer([(401, {}, "bad key", 0)]) as stub:
+        try:
+            _stub_client(stub.url).generate_title("title", "body", ["term"])
+            assert False, "expected AIResponseError"
+        except ai.AIResponseError as exception:
+            assert exception.status_code == 401
+
+    # Client errors are not retried
+    assert len(stub.requests) == 1
+
+
+def test_ai_client_times_out():
+    with StubAIServer([(200, {}, "True", 1), (200, {}, "True", 1)]) as stub:
+        client = _stub_client(stub.url, read_timeout=0.2, max_retries=1)
+        try:
+            client.check_post_valid("title", "body", ["term"])
+            assert False, "expected AIError"
+        except ai.AIError:
+            pass
+
+    assert len(stub.requests) == 2
+
+def test_ai_client_fails_over_and_opens_circuit():
+    down = [(503, {}, "down", 0)] * 2
+    with StubAIServer(down) as primary, StubAIServer([(200, {}, "True", 0)] * 4) as fallback:
+        client = _stub_client(primary.url, fallbacks=[(fallback.url, "test", "fallback")], failure_threshold=2, cooldown=60)
+        for _ in range(3):
+            assert client.check_post_valid("title", "body", ["term"])
+
+        # The primary is skipped once its circuit opens, and isn't retried while there is a fallback
+        assert (len(primary.requests), len(fallback.requests)) == (2, 3)
+
+        # Without a fallback, requests fail fast once the circuit opens
+        alone = _stub_client(primary.url, failure_threshold=2, cooldown=60, max_retries=0)
+        primary.responses = [(503, {}, "down", 0)] * 2
+        for expected in (ai.AIResponseError, ai.AIUnavailableError, ai.AIUnavailableError):
+            try:
+                alone.generate_title("title", "body", ["term"])
+                assert False, f"expected {expected.__name__}"
+            except ai.AIError as exception:
+                assert type(exception) is expected
+        assert len(primary.requests) == 4
+
+def test_ai_client_hedges_slow_requests():
+    fast = [(200, {}, "True", 0)] * 20
+    with StubAIServer(fast + [(200, {}, "True", 1)]) as primary, StubAIServer([(200, {}, "True", 0)]) as fallback:
+        client = _stub_client(primary.url, fallbacks=[(fallback.url, "test", "fallback")], hedge_percentile=95)
+        # No hedging until the primary has answered enough requests to know how slow it usually is
+        for _ in fast:
+            assert client.check_post_valid("title", "body", ["term"])
+        assert not fallback.requests
+
+        hedged = metrics.AI_HEDGED_REQUESTS.value()
+        started = time.monotonic()
+        assert client.check_post_valid("title", "body", ["term"])
+        assert time.monotonic() - started < 0.5
+        assert len(fallback.requests) == 1 and metrics.AI_HEDGED_REQUESTS.value() == hedged + 1
+
+def test_degrade_policies_while_every_endpoint_is_down():
+    submission = Submission("c1", "RTX 5080 FE", "Selling my card", "hardwareswap", "/r/hardwareswap/comments/c1/")
+    with StubAIServer([(503, {}, "down", 0)] * len(config.DEGRADE_POLICIES)) as stub:
+        for policy in config.DEGRADE_POLICIES:
+            client = _stub_client(stub.url, failure_threshold=1, cooldown=60, max_retries=0, degrade=policy)
+            try:
+                client.generate_title("title", "body", ["term"])
+            except ai.AIError:
+                pass
+
+            if policy == config.DEGRADE_RETRY:
+                try:
+                    evaluate_submission(submission, {"alice": ["5080"]}, None, client)
+                    assert False, "expected AIUnavailableError"
+                except ai.AIUnavailableError:
+                    pass
+                continue
+            level = AlertLevel.NOTIFY if policy == config.DEGRADE_NOTIFY else AlertLevel.FILTER
+            assert evaluate_submission(submission, {"alice": ["5080"], "bob": ["5080"]}, None, client) == [
+                Notification("RTX 5080 FE", "RTX 5080 FE", "/r/hardwareswap/comments/c1/", level, name) for name in ("alice", "bob")
+            ]
+
+    # Only the requests that opened each circuit reached the endpoint
+    assert len(stub.requests) == len(config.DEGRADE_POLICIES)
+
+def test_slim_body_keeps_matching_rows():
+    body = (
+        "|Item|Price|\n|:-|:-|\n|Asus Z690I Strix|$140 shipped|\n|RTX 5080 FE|$1200 cash only|\n\n"
+        "&amp;nbsp;\n\nLocal is 94587, see [timestamps](https://imgur.com/a/abc)"
+    )
+    slimmed = ai.slim_body(body, ["5080"], token_budget=800)
+    assert slimmed == "|Item|Price|\n|RTX 5080 FE|$1200 cash only|\nLocal is 94587, see timestamps"
+
+    assert ai.slim_body(body, ["5080"], token_budget=8) == "|RTX 5080 FE|$1200 cash only|"
+
+def test_slim_body_drops_sold_items():
+    body = "|Item|Price|\n|:-|:-|\n|~~RTX 5080 FE~~|~~$1000~~|\n|RTX 5080 Astral|~~$1300~~ $1250|\n\n~~Also a 5080 Super for $1100~~ sold"
+    assert ai.slim_body(body, ["5080"], token_budget=800) == "|Item|Price|\n|RTX 5080 Astral| $1250|\nsold"
+
+
+# Title formats seen on r/hardwareswap, r/hardwareswapuk, r/homelabsales and r/mechmarket
+TRADE_TITLES = [
+    ("[USA-CA] [H] RTX 5080 FE, Samsung 990 Pro 2TB [W] PayPal, Local Cash",
+     trade.TradeTitle("USA-CA", "RTX 5080 FE, Samsung 990 Pro 2TB", "PayPal, Local Cash")),
+    ("[USA-TX][H]PayPal[W]RTX 5080", trade.TradeTitle("USA-TX", "PayPal", "RTX 5080")),
+    ("[UK-London] [H] 3090 Ti - [W] £650 or 5080 + cash", trade.TradeTitle("UK-London", "3090 Ti", "£650 or 5080 + cash")),
+    ("[CAN-ON] [W] RTX 5080 [H] Cash, E-transfer", trade.TradeTitle("CAN-ON", "Cash, E-transfer", "RTX 5080")),
+    ("[US-NY] [W] RTX 5080 FE", trade.TradeTitle("US-NY", "", "RTX 5080 FE")),
+    ("[EU-DE] [H]: Dell R730xd [W]: Paypal", trade.TradeTitle("EU-DE", "Dell R730xd", "Paypal")),
+    ("[FS][US-CA] [H] Dell R730xd [W] Paypal", trade.TradeTitle("US-CA", "Dell R730xd", "Paypal")),
+    ("[US-WA] (H) Keychron Q1 (w) PayPal", trade.TradeTitle("US-WA", "Keychron Q1", "PayPal")),
+    ("[H] RTX 5080 [W] Local cash", trade.TradeTitle("", "RTX 5080", "Local cash")),
+    ("[GPU] RTX 5080 FE $999 at Best Buy", None),
+    ("Selling my RTX 5080, 1000W PSU", None),
+]
+
+def test_parse_trade_titles():
+    for title, expected in TRADE_TITLES:
+        assert trade.parse_title(title) == expected, title
+
+def test_wants_only():
+    matcher = TermMatcher(["5080"])
+    assert trade.wants_only(trade.parse_title("[USA-TX][H]PayPal[W]RTX 5080"), matcher)
+    assert trade.wants_only(trade.parse_title("[US-NY] [W] RTX 5080 FE"), matcher)
+    assert not trade.wants_only(trade.parse_title("[H] RTX 5080 [W] Local cash"), matcher)
+    assert not trade.wants_only(trade.parse_title("[UK-London] [H] 5080 Ti - [W] 5080 + cash"), matcher)
+    assert not trade.wants_only(trade.parse_title("[US-CA] [H] GPU lot [W] PayPal"), matcher)
+
+def test_sale_title_from_table():
+    body = (
+        "|Item|Condition|Price|\n|:-|:-|:-|\n|Asus Z690I Strix|Used|$140 shipped|\n"
+        "|Samsung 990 Evo Plus 1TB NVME SSD|Brand new sealed|$60 shipped |\n"
+        "|RTX 5080 FE - will not ship, local sales only|Brand new sealed|$1200 cash only |\n\n&amp;nbsp;\n\nLocal is 94587."
+    )
+    assert extract.sale_title(body, ["5080", "SSD"]) == "Samsung 990 Evo Plus 1TB NVME SSD - $60, RTX 5080 FE (Local Only) - $1200"
+    assert extract.sale_title(body, ["3090"]) is None
+
+def test_sale_title_from_list():
+    assert extract.sale_title("* RTX 5080 FE - $1,150 shipped\n* 1000W PSU - $90", ["5080"]) == "RTX 5080 FE - $1,150"
+    # Prose and terms without a price are left to the AI
+    assert extract.sale_title("Selling my RTX 5080 FE for $1,150 shipped", ["5080"]) is None
+    assert extract.sale_title("* RTX 5080 FE - $1,150\n* RTX 4090, make an offer", ["5080", "4090"]) is None
+
+def test_sale_title_skips_sold_items():
+    assert extract.sale_title("* ~~RTX 5080 - $1000~~ SOLD\n* RTX 5080 Super - $1100", ["5080"]) == "RTX 5080 Super - $1100"
+    body = "|Item|Price|\n|:-|:-|\n|~~RTX 5080 FE~~|~~$1000~~|\n|RTX 5080 Gaming OC|$1050 SOLD|\n|RTX 5080 Astral|~~$1300~~ $1250|"
+    assert extract.sale_title(body, ["5080"]) == "RTX 5080 Astral - $1250"
+
+def test_watchlist_index_matches_each_user():
+    alice = DummySubConfig(include=["5080", "SSD"], exclude=["broken"], subreddit="hardwareswap")
+    bob = DummySubConfig(include=["ssd", "4090"], exclude=[], subreddit="HardwareSwap")
+    carol = DummySubConfig(include=[], exclude=["paypal"], subreddit="hardwareswap")
+    index = WatchlistIndex([Watchlist("alice", alice, None), Watchlist("bob", bob, None), Watchlist("carol", carol, None)])
+
+    assert index.subreddits == ["hardwareswap"]
+    assert index.match("hardwareswap", "[H] RTX 5080, 1TB SSD [W] Cash", "") == {
+        "alice": ["5080", "SSD"], "bob": ["ssd"], "carol": [],
+    }
+    assert index.match("hardwareswap", "[H] broken SSD [W] PayPal", "") == {"bob": ["ssd"]}
+    assert index.match("buildapcsales", "[SSD] 1TB SSD $50", "") == {}
+
+def test_watchlist_index_update_only_rebuilds_changed_subreddits():
+    alice = DummySubConfig(include=["5080"], exclude=[], subreddit="hardwareswap")
+    bob = DummySubConfig(include=["ssd"], exclude=[], subreddit="buildapcsales")
+    index = WatchlistIndex([Watchlist("alice", alice, None), Watchlist("bob", bob, None)])
+    unchanged = index.match("buildapcsales", "[SSD] 1TB SSD $50", "")
+
+    changed = index.update([Watchlist("alice", DummySubConfig(include=["4090"], exclude=[], subreddit="hardwareswap"), None),
+                            Watchlist("bob", bob, None),
+                            Watchlist("carol", DummySubConfig(include=["cpu"], exclude=[], subreddit="cpus"), None)])
+
+    assert changed == {"hardwareswap", "cpus"}
+    assert index.match("hardwareswap", "[H] RTX 5080, RTX 4090 [W] Cash", "") == {"alice": ["4090"]}
+    assert index.match("buildapcsales", "[SSD] 1TB SSD $50", "") == unchanged
+    assert index.get("carol") is not None and index.match("cpus", "New CPU", "") == {"carol": ["cpu"]}
+
+def test_parse_verdict_handles_malformed_and_partial_output():
+    assert ai.parse_verdict('{"valid": true, "title": " RTX 5080 FE - $1200 "}') == ai.PostVerdict(True, "RTX 5080 FE - $1200")
+    # Thinking, code fences and prose around the JSON are ignored
+    assert ai.parse_verdict('<thinking>{"valid": false}</thinking>Sure:\n```json\n{"valid": "False"}\n```') == ai.PostVerdict(False, "")
+    # Valid posts need a title, and the verdict has to be a boolean
+    assert ai.parse_verdict('{"valid": true, "title": ""}') is None
+    assert ai.parse_verdict('{"valid": true}') is None
+    assert ai.parse_verdict('{"valid": "maybe", "title": "RTX 5080"}') is None
+    # Truncated or missing JSON
+    assert ai.parse_verdict('{"valid": true, "title": "RTX 50') is None
+    assert ai.parse_verdict('{"valid": true, "title": "RTX 5080",}') is None
+    assert ai.parse_verdict("True") is None
+
+def test_parse_batched_verdicts():
+    response = '```json\n{"1": {"valid": true, "title": "RTX 5080 FE - $1200"}, "2": {"valid": false, "title": ""}, "3": "?"}\n```'
+    assert ai.parse_verdicts(response, 3) == [ai.PostVerdict(True, "RTX 5080 FE - $1200"), ai.PostVerdict(False, ""), None]
+    assert ai.parse_verdicts("not json", 2) == [None, None]
+
+def test_micro_batcher_groups_overlapping_calls():
+    calls = []
+    def send_batch(items):
+        calls.append(list(items))
+        time.sleep(0.2)
+        return [item * 2 for item in items]
+
+    batcher = MicroBatcher(send_batch, max_size=3, max_wait=1)
+    # Nothing else is running, so the first call goes out alone without waiting
+    results = {}
+    threads = [threading.Thread(target=lambda item=item: results.update({item: batcher.submit(item)})) for item in range(4)]
+    threads[0].start()
+    time.sleep(0.05)
+    for thread in threads[1:]:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == {0: 0, 1: 2, 2: 4, 3: 6}
+    assert [len(call) for call in calls] == [1, 3]
+
+class StubReddit:
+    """Serves fixed listings per multireddit, failing for the ones in `failing`."""
+    def __init__(self, posts, failing=()):
+        self.posts = posts
+        self.failing = set(failing)
+        self.auth = SimpleNamespace(limits={"remaining": None, "reset_timestamp": None, "used": None})
+
+    def subreddit(self, name):
+        return SimpleNamespace(new=lambda limit: self._new(name, limit))
+
+    def _new(self, name, limit):
+        subs = name.split("+")
+        if self.failing & set(subs):
+            raise prawcore.exceptions.ServerError(SimpleNamespace(status_code=503))
+        return [post for post in self.posts if post.subreddit.display_name in subs][:limit]
+
+def test_poll_scheduler_backs_off_per_shard():
+    posts = [Submission(str(i), f"post {i}", "", sub, f"/r/{sub}/{i}") for i, sub in enumerate(["a", "b", "c"])]
+    seen = SeenStore(None, 100)
+    seen.add("older")
+    errors = []
+    scheduler = PollScheduler(StubReddit(posts, failing={"c"}), ["a", "b", "c"], seen, catch_up_limit=100,
+                              shard_size=2, min_interval=5, max_interval=60, on_error=errors.append)
+
+    assert [shard.subreddits for shard in scheduler.shards] == [["a", "b"], ["c"]]
+    healthy, failing = scheduler.shards
+    assert [post.id for post in scheduler.poll(healthy)] == ["1", "0"]
+    assert scheduler.poll(failing) == [] and scheduler.poll(failing) == []
+
+    # Only the first failure of an outage is alerted, and only the failing shard backs off
+    assert len(errors) == 1 and failing.failures == 2
+    assert failing.next_poll - time.monotonic() > 15
+    assert healthy.next_poll - time.monotonic() <= 5
+
+def test_poll_scheduler_catches_up_once_after_restart(tmp_path):
+    path = str(tmp_path / "seen.db")
+    reddit = StubReddit([Submission(str(i), f"post {i}", "", "hardwareswap", f"/r/hardwareswap/{i}") for i in (2, 1)])
+
+    def restart():
+        seen = SeenStore(path, 100)
+        scheduler = PollScheduler(reddit, ["hardwareswap"], seen, catch_up_limit=100,
+                                  shard_size=10, min_interval=5, max_interval=60, on_error=[].append)
+        return seen, scheduler, scheduler.shards[0]
+
+    # The very first run only marks the current posts seen
+    seen, scheduler, shard = restart()
+    assert scheduler.poll(shard) == []
+
+    # Posts made while the app was stopped are returned oldest first, and only once
+    reddit.posts = [Submission(str(i), f"post {i}", "", "hardwareswap", f"/r/hardwareswap/{i}") for i in (5, 4, 3)] + reddit.posts
+    seen, scheduler, shard = restart()
+    caught_up = scheduler.poll(shard)
+    assert [post.id for post in caught_up] == ["3", "4", "5"]
+    for post in caught_up:
+        seen.add(post.id)
+    assert scheduler.poll(shard) == []
+
+    seen, scheduler, shard = restart()
+    assert scheduler.poll(shard) == []
+
+def test_poll_scheduler_finds_quiet_posts_behind_busy_ones():
+    # Newest first: a busy subreddit's seen posts, then a quiet one's post made while the app was stopped
+    posts = [Submission(str(i), f"post {i}", "", "busy", f"/r/busy/{i}") for i in range(15)]
+    posts.append(Submission("15", "quiet post", "", "quiet", "/r/quiet/q"))
+    seen = SeenStore(None, 100)
+    for post in posts[:-1]:
+        seen.add(post.id)
+    scheduler = PollScheduler(StubReddit(posts), ["busy", "quiet"], seen, catch_up_limit=100,
+                              shard_size=2, min_interval=5, max_interval=60, on_error=[].append)
+
+    # As after a regroup that keeps the catch up state
+    shard, = scheduler.shards
+    shard.caught_up = True
+    assert [post.id for post in scheduler.poll(shard)] == ["15"]
+
+def test_backfill_scan_matches_dump_lines():
+    posts = [
+        {"id": "a1", "subreddit": "HardwareSwap", "title": "[H] RTX 5080 [W] Cash", "selftext": "", "created_utc": 100},
+        {"id": "a2", "subreddit": "hardwareswap", "title": "[H] broken 5080 [W] Cash", "selftext": "", "created_utc": 200},
+        {"id": "a3", "subreddit": "hardwareswap", "title": "[H] 5080 [W] Cash", "selftext": None, "created_utc": 50},
+        {"id": "a4", "subreddit": "buildapcsales", "title": "[GPU] 5080 $999", "selftext": "", "created_utc": 300},
+    ]
+    dump = io.StringIO("\n".join([json.dumps(post) for post in posts] + ["", "not json"]))
+    watchlists = [Watchlist("alice", DummySubConfig(include=["5080"], exclude=["broken"], subreddit="hardwareswap"), None)]
+
+    results = list(backfill.scan(dump, watchlists, processes=2, after=60))
+    read = sum(chunk_read for chunk_read, _, _ in results)
+    skipped = sum(chunk_skipped for _, chunk_skipped, _ in results)
+    matches = [(record["id"], record["permalink"], found) for _, _, chunk in results for record, found in chunk]
+
+    assert (read, skipped) == (3, 2)
+    assert matches == [("a1", "/r/HardwareSwap/comments/a1/", {"alice": ["5080"]})]
+
+def test_backfill_scan_screens_want_only_posts():
+    posts = [
+        {"id": "b1", "subreddit": "hardwareswap", "title": "[USA-TX] [H] PayPal [W] RTX 5080", "selftext": "", "created_utc": 100},
+        {"id": "b2", "subreddit": "hardwareswap", "title": "[USA-TX] [H] RTX 5080 [W] PayPal", "selftext": "", "created_utc": 100},
+    ]
+    dump = io.StringIO("\n".join(json.dumps(post) for post in posts))
+    watchlists = [
+        Watchlist(name, config.SubredditConfig({"hardwareswap": {"include": ["5080"], "want_only": want_only}}), None)
+        for name, want_only in (("alice", "skip"), ("bob", "filter"), ("carol", None))
+    ]
+
+    matches = [(record["id"], record["want_only"], found) for _, _, chunk in backfill.scan(dump, watchlists, processes=1)
+               for record, found in chunk]
+    assert matches == [
+        ("b1", ["bob"], {"carol": ["5080"]}),
+        ("b2", [], {"alice": ["5080"], "bob": ["5080"], "carol": ["5080"]}),
+    ]
+
+def test_term_matcher_finds_overlapping_and_implied_terms():
+    matcher = TermMatcher(["RTX 5080", "5080", "5080 FE", "FE", "3090"])
+    # "RTX 5080" and "5080 FE" overlap, and each implies the shorter terms inside it
+    assert matcher.find("Selling my rtx 5080 fe") == ["RTX 5080", "5080", "5080 FE", "FE"]
+    assert matcher.find("[H] 5080 [W] Cash") == ["5080"]
+    assert matcher.find("[H] 4090 [W] Cash") == []
+    # Every configured spelling of a term is reported
+    assert TermMatcher(["SSD", "ssd"]).find("1TB Ssd") == ["SSD", "ssd"]
+    assert TermMatcher([]).find("anything") == []
+
+def test_subreddit_config_treats_empty_keys_as_no_terms():
+    sub_config = config.SubredditConfig(yaml.safe_load("HardwareSwap:\n  include:\n    - '5080'\n  exclude:\ngamedeals:\n"))
+    assert sub_config.exclude_terms("hardwareswap") == [] and sub_config.include_terms("gamedeals") == []
+    index = WatchlistIndex([Watchlist(DEFAULT_WATCHLIST, sub_config, None)])
+    assert index.match("hardwareswap", "[H] 5080 [W] Cash", "") == {DEFAULT_WATCHLIST: ["5080"]}
+    assert index.match("gamedeals", "Free game", "") == {DEFAULT_WATCHLIST: []}
+
+def test_response_cache_expires_and_bounds_memory():
+    cache = ResponseCache(None, memory_size=2, disk_size=10, ttl=60)
+    for key in ("a", "b", "c"):
+        cache.put(key, key.upper())
+    # The least recently used entry is dropped from memory
+    assert [cache.get(key) for key in ("a", "b", "c")] == [None, "B", "C"]
+
+    expired = ResponseCache(None, memory_size=2, disk_size=10, ttl=-1)
+    expired.put("a", "A")
+    assert expired.get("a") is None
+    assert (cache.hits, cache.misses) == (2, 1)
+
+def test_response_cache_persists_and_prunes_on_disk(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = ResponseCache(path, memory_size=10, disk_size=2, ttl=60)
+    for key in ("a", "b", "c"):
+        cache.put(key, key.upper())
+        time.sleep(0.01)
+
+    # Reopening prunes the rows beyond disk_size, keeping the ones expiring last
+    reopened = ResponseCache(path, memory_size=10, disk_size=2, ttl=60)
+    assert [reopened.get(key) for key in ("a", "b", "c")] == [None, "B", "C"]
+
+def test_ai_cache_can_be_turned_off():
+    with StubAIServer([(200, {}, "RTX 5080 FE - $1200", 0)] * 2) as stub:
+        client = config.AIConfig({"client": stub.url, "secret": "test", "agent": "test", "cache": False}).client
+        assert client.cache is None
+        for _ in range(2):
+            assert client.generate_title("title", "body", ["5080"]) == "RTX 5080 FE - $1200"
+    assert len(stub.requests) == 2
+
+def test_work_queue_resumes_and_dedupes(tmp_path):
+    path = str(tmp_path / "queue.db")
+    queue = WorkQueue(path, max_pending=10, max_attempts=3, backoff=1)
+    assert queue.put("a", {"n": 1}) and queue.put("b", {"n": 2})
+    assert not queue.put("a", {"n": 1})
+    claimed = queue.get(timeout=0)
+    queue.done(queue.get(timeout=0))
+
+    # A job in progress when the app stopped is handed out again, finished ones stay recognised
+    restarted = WorkQueue(path, max_pending=10, max_attempts=3, backoff=1)
+    assert restarted.get(timeout=0) == claimed
+    assert not restarted.put("b", {"n": 2})
+
+def test_work_queue_backs_off_and_dead_letters():
+    queue = WorkQueue(None, max_pending=1, max_attempts=2, backoff=0.2)
+    queue.put("a", {})
+    assert queue.retry(queue.get(timeout=0), "AI down")
+
+    # Waiting out its delay, the job neither runs early nor blocks new jobs
+    assert queue.get(timeout=0.05) is None
+    started = time.monotonic()
+    assert queue.put("b", {})
+    assert time.monotonic() - started < 0.5
+
+    assert queue.get(timeout=0).id == "b"
+    job = queue.get(timeout=1)
+    assert job.id == "a" and job.attempts == 1
+    assert not queue.retry(job, "AI down")
+    assert queue.counts()["dead"] == 1
+
+def test_alert_queue_depth_covers_every_client():
+    clients = [alert.Client(config.AlertConfig({"notify": ["json://localhost:1/"]}), test_destinations=False, watchlist=name)
+               for name in ("alice", "bob")]
+    rendered = "\n".join(metrics.ALERT_QUEUE_DEPTH.render())
+    assert 'level="notify",service="json",watchlist="alice"' in rendered
+    assert 'level="notify",service="json",watchlist="bob"' in rendered
+
+    clients[0].close()
+    rendered = "\n".join(metrics.ALERT_QUEUE_DEPTH.render())
+    assert 'watchlist="alice"' not in rendered and 'watchlist="bob"' in rendered
+    clients[1].close()
+
+def test_config_watcher_keeps_running_config_on_errors(tmp_path, monkeypatch):
+    path = tmp_path / "config.yaml"
+    path.write_text("reddit:\n  subreddits:\n    hardwareswap:\n      include: [\"5080\"]\napprise: {}\n")
+    monkeypatch.setattr(config, "_CONFIG_PATH", str(path))
+    changes, errors = [], []
+    failing = [True]
+    def on_change(watchlists):
+        if failing[0]:
+            raise ValueError("invalid subreddit: nosuchsub")
+        changes.append(watchlists)
+    watcher = config.ConfigWatcher(on_change, on_error=errors.append)
+
+    # A list instead of a mapping fails with a TypeError while loading
+    path.write_text("- reddit\n")
+    watcher.reload()
+    path.write_text("reddit:\n  subreddits:\n    hardwareswap:\n      include: [\"4090\"]\napprise: {}\n")
+    watcher.reload()
+    assert len(errors) == 2 and not changes
+
+    # The rejected change was never applied, so it is tried again on the next reload
+    failing[0] = False
+    watcher.reload()
+    assert [watchlist.sub_config.include_terms("hardwareswap") for watchlist in changes[0]] == [["4090"]]
+
+def test_reload_watchlists_applies_all_or_nothing():
+    default = config.WatchlistConfig(DEFAULT_WATCHLIST, {"subreddits": {"hardwareswap": {"include": ["5080"]}}})
+    watchlists = WatchlistIndex([Watchlist(DEFAULT_WATCHLIST, default.sub_config,
+                                           alert.Client(default.alert_config, test_destinations=False))])
+    scheduler = SimpleNamespace(updates=[])
+    scheduler.update_subreddits = scheduler.updates.append
+    startup_config = config.StartupConfig({}, {config.STARTUP_CHECK_VALIDATE_SUBREDDITS})
+    alice = {"subreddits": {"buildapcsales": {"include": ["ssd"]}}}
+
+    # An unsupported alert target in any watchlist keeps every watchlist as it was
+    try:
+        reload_watchlists([default, config.WatchlistConfig("alice", dict(alice, apprise={"notify": ["ntfy://topic"]}))],
+                          watchlists, scheduler, None, startup_config)
+        assert False, "expected ValueError"
+    except ValueError:
+        pass
+    assert watchlists.get("alice") is None and not scheduler.updates
+
+    reload_watchlists([default, config.WatchlistConfig("alice", alice)], watchlists, scheduler, None, startup_config)
+    assert watchlists.get("alice").alert_client.watchlist == "alice"
+    assert sorted(scheduler.updates[0]) == ["buildapcsales", "hardwareswap"]
+    for watchlist in watchlists:
+        watchlist.alert_client.close()
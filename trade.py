@@ -0,0 +1,47 @@
+"""Parsing of `[LOC] [H] ... [W] ...` trade post titles."""
+import re
+from typing import NamedTuple
+
+from matcher import TermMatcher
+
+# [H], (W), {Have}, [want]: ... in any order, the first letter tells the side
+_TAG = re.compile(r"[\[({]\s*(h|w|have|want)\s*[\])}]\s*:?", re.IGNORECASE)
+_LOCATION = re.compile(r"[\[({]\s*([^\])}]+?)\s*[\])}]")
+_SEPARATORS = " \t-|,:"
+
+
+class TradeTitle(NamedTuple):
+    location: str
+    have: str
+    want: str
+
+
+def parse_title(title: str) -> TradeTitle | None:
+    """Split a trade title into its location, have and want sections.
+
+    Returns None if the title has no [H] or [W] tag. A side that isn't
+    tagged, like in `[USA-CA] [W] RTX 5080`, is left empty.
+    """
+    tags = list(_TAG.finditer(title))
+    if not tags:
+        return None
+
+    sections = {"h": [], "w": []}
+    for tag, following in zip(tags, tags[1:] + [None]):
+        end = following.start() if following else len(title)
+        text = title[tag.end():end].strip(_SEPARATORS)
+        if text:
+            sections[tag.group(1)[0].lower()].append(text)
+
+    # Some subs put a listing type first, like [FS] [US-CA], the location is the last bracket
+    locations = _LOCATION.findall(title, 0, tags[0].start())
+    return TradeTitle(
+        locations[-1] if locations else "",
+        " ".join(sections["h"]),
+        " ".join(sections["w"]),
+    )
+
+
+def wants_only(trade: TradeTitle, matcher: TermMatcher) -> bool:
+    """Whether include terms appear in the want section of the title and not in the have section."""
+    return not matcher.find(trade.have) and bool(matcher.find(trade.want))
@@ -0,0 +1,109 @@
+"""Watchlists for several users, matched against each post in a single pass."""
+from typing import NamedTuple
+
+import alert
+from config import SubredditConfig
+from matcher import TermMatcher
+
+
+class Watchlist(NamedTuple):
+    name: str
+    sub_config: SubredditConfig
+    alert_client: alert.Client
+
+
+class _SubredditIndex:
+    """Every watchlist's terms for one subreddit, with an inverted index from term to watchlist."""
+    def __init__(self):
+        self.includers: dict[str, list[str]] = {}
+        self.excluders: dict[str, list[str]] = {}
+        # Watchlists without include terms match every post
+        self.match_all: list[str] = []
+        self.include: TermMatcher | None = None
+        self.exclude: TermMatcher | None = None
+        # What was added, to tell whether a reload changed this subreddit
+        self.terms: list[tuple[str, tuple[str, ...], tuple[str, ...]]] = []
+
+    def add(self, name: str, include_terms: list[str], exclude_terms: list[str]):
+        self.terms.append((name, tuple(include_terms), tuple(exclude_terms)))
+        for term in include_terms:
+            self.includers.setdefault(term, []).append(name)
+        for term in exclude_terms:
+            self.excluders.setdefault(term, []).append(name)
+        if not include_terms:
+            self.match_all.append(name)
+
+    def build(self):
+        self.include = TermMatcher(list(self.includers))
+        self.exclude = TermMatcher(list(self.excluders))
+
+
+class WatchlistIndex:
+    """All watchlists, so each post is scanned once no matter how many users watch its subreddit.
+
+    The include and exclude terms of every watchlist are folded into one
+    matcher per subreddit, and the hits are mapped back to the watchlists
+    that configured them.
+    """
+    def __init__(self, watchlists: list[Watchlist]):
+        self._watchlists = {watchlist.name: watchlist for watchlist in watchlists}
+        self._subreddits = self._index(watchlists, {})
+
+    def update(self, watchlists: list[Watchlist]) -> set[str]:
+        """Switch to changed watchlists, returning the subreddits whose terms changed.
+
+        Matchers are only recompiled for those subreddits, posts being matched
+        meanwhile use the old ones.
+        """
+        subreddits = self._index(watchlists, self._subreddits)
+        changed = {sub for sub in subreddits.keys() | self._subreddits.keys()
+                   if subreddits.get(sub) is not self._subreddits.get(sub)}
+        self._watchlists = {watchlist.name: watchlist for watchlist in watchlists}
+        self._subreddits = subreddits
+        return changed
+
+    @staticmethod
+    def _index(watchlists: list[Watchlist], previous: dict[str, _SubredditIndex]) -> dict[str, _SubredditIndex]:
+        subreddits: dict[str, _SubredditIndex] = {}
+        for watchlist in watchlists:
+            for sub in watchlist.sub_config.subreddits:
+                subreddits.setdefault(sub.lower(), _SubredditIndex()).add(
+                    watchlist.name, watchlist.sub_config.include_terms(sub), watchlist.sub_config.exclude_terms(sub)
+                )
+        for sub, index in subreddits.items():
+            unchanged = previous.get(sub)
+            if unchanged is not None and unchanged.terms == index.terms:
+                subreddits[sub] = unchanged
+            else:
+                index.build()
+        return subreddits
+
+    @property
+    def subreddits(self) -> list[str]:
+        return list(self._subreddits)
+
+    def __iter__(self):
+        return iter(self._watchlists.values())
+
+    def get(self, name: str) -> Watchlist | None:
+        return self._watchlists.get(name)
+
+    def match(self, subreddit: str, title: str, body: str) -> dict[str, list[str]]:
+        """Return the include terms found in the post for each watchlist it matches."""
+        index = self._subreddits.get(subreddit.lower())
+        if index is None:
+            return {}
+
+        # NUL never appears in a term, so no match can span title and body
+        text = f"{title}\0{body}"
+        excluded = {name for term in index.exclude.find(text) for name in index.excluders[term]}
+
+        matches: dict[str, list[str]] = {}
+        for term in index.include.find(text):
+            for name in index.includers[term]:
+                if name not in excluded:
+                    matches.setdefault(name, []).append(term)
+        for name in index.match_all:
+            if name not in excluded:
+                matches.setdefault(name, [])
+        return matches
@@ -0,0 +1,153 @@
+"""Crash-safe SQLite work queue for matched posts."""
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import NamedTuple
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+IN_PROGRESS = "in_progress"
+DONE = "done"
+DEAD = "dead"
+
+_MAX_RETRY_DELAY = 60 * 60
+# Finished jobs are kept this long so reposted IDs are still recognised
+_DONE_RETENTION = 7 * 24 * 60 * 60
+
+
+class Job(NamedTuple):
+    id: str
+    payload: dict
+    attempts: int
+
+
+class WorkQueue:
+    """Queue of jobs keyed by ID that survives restarts.
+
+    Jobs move from pending to in_progress to done. Failed jobs go back to
+    pending with an exponential delay, or to dead once they run out of
+    attempts. Jobs left in_progress by a crash are resumed on startup.
+
+    Only jobs that are due or in progress count towards `max_pending`, so
+    jobs waiting out a retry delay during a long outage never block `put`.
+    """
+    def __init__(self, path: str, max_pending: int, max_attempts: int, backoff: float):
+        self._max_pending = max_pending
+        self._max_attempts = max_attempts
+        self._backoff = backoff
+        self._condition = threading.Condition()
+        self._closed = False
+
+        self._db = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, payload TEXT NOT NULL, state TEXT NOT NULL, "
+            "attempts INTEGER NOT NULL DEFAULT 0, available REAL NOT NULL, "
+            "updated REAL NOT NULL, error TEXT)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, available)")
+
+        now = time.time()
+        resumed = self._db.execute(
+            "UPDATE jobs SET state = ?, updated = ? WHERE state = ?", (PENDING, now, IN_PROGRESS)
+        ).rowcount
+        self._db.execute("DELETE FROM jobs WHERE state = ? AND updated < ?", (DONE, now - _DONE_RETENTION))
+        self._db.commit()
+
+        counts = self.counts()
+        logger.info("Work queue: %d pending (%d resumed), %d dead", counts[PENDING], resumed, counts[DEAD])
+
+    def put(self, job_id: str, payload: dict) -> bool:
+        """Add a job, blocking while `max_pending` jobs are due or in progress.
+
+        Returns False if a job with this ID was already queued or processed.
+        """
+        with self._condition:
+            while self._active() >= self._max_pending:
+                self._condition.wait(1)
+
+            now = time.time()
+            added = self._db.execute(
+                "INSERT OR IGNORE INTO jobs (id, payload, state, available, updated) VALUES (?, ?, ?, ?, ?)",
+                (job_id, json.dumps(payload), PENDING, now, now),
+            ).rowcount
+            self._db.commit()
+
+            self._condition.notify_all()
+            return added == 1
+
+    def get(self, timeout: float) -> Job | None:
+        """Claim the next job that is due, waiting up to `timeout` seconds.
+
+        Returns None on timeout or once the queue is closed.
+        """
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while not self._closed:
+                now = time.time()
+                row = self._db.execute(
+                    "SELECT id, payload, attempts FROM jobs WHERE state = ? AND available <= ? "
+                    "ORDER BY available LIMIT 1",
+                    (PENDING, now),
+                ).fetchone()
+                if row:
+                    self._set_state(row[0], IN_PROGRESS)
+                    self._condition.notify_all()
+                    return Job(row[0], json.loads(row[1]), row[2])
+
+                wait = deadline - time.monotonic()
+                next_due = self._db.execute(
+                    "SELECT MIN(available) FROM jobs WHERE state = ?", (PENDING,)
+                ).fetchone()[0]
+                if next_due is not None:
+                    wait = min(wait, next_due - now)
+                if deadline <= time.monotonic():
+                    return None
+                self._condition.wait(max(wait, 0.01))
+            return None
+
+    def done(self, job: Job):
+        with self._condition:
+            self._set_state(job.id, DONE)
+
+    def retry(self, job: Job, error: str) -> bool:
+        """Put a failed job back with a delay, returning False if it was dead-lettered instead."""
+        attempts = job.attempts + 1
+        with self._condition:
+            if attempts >= self._max_attempts:
+                self._set_state(job.id, DEAD, attempts=attempts, error=error)
+                return False
+
+            delay = min(_MAX_RETRY_DELAY, self._backoff * 2 ** job.attempts)
+            self._set_state(job.id, PENDING, attempts=attempts, error=error, available=time.time() + delay)
+            self._condition.notify_all()
+            return True
+
+    def close(self):
+        """Stop handing out jobs and release threads blocked in `get`."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def counts(self) -> dict[str, int]:
+        with self._condition:
+            counts = dict.fromkeys((PENDING, IN_PROGRESS, DONE, DEAD), 0)
+            counts.update(self._db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+            return counts
+
+    def _active(self) -> int:
+        """Jobs due now or in progress, not counting the ones waiting out a retry delay."""
+        return self._db.execute(
+            "SELECT COUNT(*) FROM jobs WHERE (state = ? AND available <= ?) OR state = ?",
+            (PENDING, time.time(), IN_PROGRESS),
+        ).fetchone()[0]
+
+    def _set_state(self, job_id: str, state: str, **fields):
+        fields = {"state": state, "updated": time.time(), **fields}
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        self._db.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+        self._db.commit()